@@ -24,10 +24,8 @@ output_file = open("results.csv", "w")
 
 def handle_measurement(device, measurement):
 	if isinstance(device, FrameDetector) and device.ports == [2, 3]:
-		measurement.payload = measurement.payload.hex()
-
-		output_file.write(",".join(map(str, measurement.__dict__.values())))
-		output_file.write("\n")
+		output_file.write(",".join(map(str, measurement.astuple()[:-1])))
+		output_file.write("," + measurement.payload.hex() + "\n")
 
 async def main():
 	# Scan for devices, ask the user to select one if multiple devices are found
@@ -35,7 +35,7 @@ files = [
 ]
 
 def handle_measurement(device, measurement):
-	measurement_csv = ",".join(map(str, measurement.__dict__.values()))
+	measurement_csv = ",".join(map(str, measurement.astuple()))
 
 	if isinstance(device, LatencyMeasurer):
 		files[0].write(measurement_csv)
@@ -104,33 +104,42 @@ async def main():
 	tg0_template, tg0_source = TrafficGenerator.load_frame_template("udp_broadcast.hex")
 	tg1_template, tg1_source = TrafficGenerator.load_frame_template("udp_unicast.hex")
 
-	await lm.set_property(Properties.PROP_MAC_ADDR, "9A:B1:2B:CF:93:02", {"index": 0})
-	await lm.set_property(Properties.PROP_MAC_ADDR, "9A:B1:2B:CF:93:03", {"index": 1})
-	await lm.set_property(Properties.PROP_IP_ADDR, "192.168.111.102", {"index": 0})
-	await lm.set_property(Properties.PROP_IP_ADDR, "192.168.111.103", {"index": 1})
-	await lm.set_property(Properties.PROP_FRAME_PADDING, 82)
-	await lm.set_property(Properties.PROP_FRAME_GAP, 6250000 - 82)
-	await lm.set_property(Properties.PROP_ENABLE_LOG, True)
-	await lm.set_property(Properties.PROP_ENABLE, True)
-
-	await tgen0.set_property(Properties.PROP_FRAME_TEMPLATE, tg0_template)
-	await tgen0.set_property(Properties.PROP_FRAME_SOURCE, tg0_source)
-	await tgen0.set_property(Properties.PROP_FRAME_SIZE, 1500)
-	await tgen0.set_property(Properties.PROP_FRAME_GAP, 1200000)
-	await tgen0.set_property(Properties.PROP_ENABLE, True)
-
-	await tgen1.set_property(Properties.PROP_FRAME_TEMPLATE, tg1_template)
-	await tgen1.set_property(Properties.PROP_FRAME_SOURCE, tg1_source)
-	await tgen1.set_property(Properties.PROP_FRAME_SIZE, 1500)
-	await tgen1.set_property(Properties.PROP_FRAME_GAP, 1200000)
-	await tgen1.set_property(Properties.PROP_ENABLE, True)
+	config = {
+		lm: {
+			Properties.PROP_MAC_ADDR: [("9A:B1:2B:CF:93:02", {"index": 0}), ("9A:B1:2B:CF:93:03", {"index": 1})],
+			Properties.PROP_IP_ADDR: [("192.168.111.102", {"index": 0}), ("192.168.111.103", {"index": 1})],
+			Properties.PROP_FRAME_PADDING: 82,
+			Properties.PROP_FRAME_GAP: 6250000 - 82,
+			Properties.PROP_ENABLE_LOG: True,
+			Properties.PROP_ENABLE: True
+		},
+		tgen0: {
+			Properties.PROP_FRAME_TEMPLATE: tg0_template,
+			Properties.PROP_FRAME_SOURCE: tg0_source,
+			Properties.PROP_FRAME_SIZE: 1500,
+			Properties.PROP_FRAME_GAP: 1200000,
+			Properties.PROP_ENABLE: True
+		},
+		tgen1: {
+			Properties.PROP_FRAME_TEMPLATE: tg1_template,
+			Properties.PROP_FRAME_SOURCE: tg1_source,
+			Properties.PROP_FRAME_SIZE: 1500,
+			Properties.PROP_FRAME_GAP: 1200000,
+			Properties.PROP_ENABLE: True
+		},
+		timer: {
+			Properties.PROP_TIMER_LIMIT: 10 * timer.freq
+		}
+	}
 
 	for d in [sc0, sc1, sc2, sc3]:
-		await d.set_property(Properties.PROP_SAMPLE_PERIOD, timer.freq // 10)
-		await d.set_property(Properties.PROP_ENABLE_LOG, True)
-		await d.set_property(Properties.PROP_ENABLE, True)
+		config[d] = {
+			Properties.PROP_SAMPLE_PERIOD: timer.freq // 10,
+			Properties.PROP_ENABLE_LOG: True,
+			Properties.PROP_ENABLE: True
+		}
 
-	await timer.set_property(Properties.PROP_TIMER_LIMIT, 10 * timer.freq)
+	await client.configure(config)
 
 	# Register measurement handler
 
@@ -25,6 +25,7 @@ setuptools.setup(
 	packages = setuptools.find_packages(),
 
 	install_requires=["netifaces"],
+	extras_require={"numpy": ["numpy"]},
 
 	author = "Oscar R.",
 	author_email = "oscar@oscar-rc.dev",
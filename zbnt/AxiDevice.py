@@ -16,17 +16,101 @@
 	along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
+import struct
+
 from .Enums import *
+from .Encoding import *
+from .MeasurementQueue import *
 
 class AxiDevice:
 	device_type = 0
 	_property_encoding = dict()
 	_property_params = dict()
+	_volatile_properties = set()
+	_property_codecs = dict()
+	_measurement_schema = None
+	_measurement_dtype = None
+
+	def __init_subclass__(cls, **kwargs):
+		super().__init_subclass__(**kwargs)
+
+		cls._property_codecs = {
+			prop_id: AxiDevice.compile_property_codec(prop_encoding, cls._property_params.get(prop_id, (0, [])))
+			for prop_id, prop_encoding in cls._property_encoding.items()
+		}
+
+	@staticmethod
+	def compile_property_codec(prop_encoding, prop_params):
+		# Returns (encoder, decoder, params_encoder), where encoder(value, params) returns the encoded parameters
+		# followed by the value and decoder(data) decodes a value that follows the parameters, or returns None if
+		# data is too short or can't be decoded
+		# Fixed size values and parameters are packed with a single struct, other encodings are used as they are
+		value_encoder, value_decoder = prop_encoding
+		params_size, params_list = prop_params
+		param_names = [param_name for param_name, _ in params_list]
+		param_formats = [struct_formats.get(param_encoder, None) for _, param_encoder in params_list]
+
+		def get_params(params):
+			values = [params.get(param_name, None) for param_name in param_names]
+
+			for param_name, param_value in zip(param_names, values):
+				if param_value == None:
+					raise ValueError("Missing parameter: {0}".format(param_name))
+
+			return values
+
+		if None not in param_formats:
+			params_struct = get_struct("".join(param_formats))
+			params_encoder = lambda params: params_struct.pack(*get_params(params))
+		else:
+			params_struct = None
+			params_encoder = lambda params: b"".join(
+				param_encoder(param_value) for (_, param_encoder), param_value in zip(params_list, get_params(params))
+			)
+
+		if value_encoder == None:
+			encoder = None
+		elif params_struct != None and value_encoder in struct_formats:
+			encoder_struct = get_struct(params_struct.format + struct_formats[value_encoder])
+
+			if len(param_names) == 0:
+				encoder = lambda value, params: pack_int(encoder_struct, value)
+			else:
+				encoder = lambda value, params: pack_int(encoder_struct, *get_params(params), value)
+		else:
+			encoder = lambda value, params: params_encoder(params) + value_encoder(value)
+
+		if value_decoder == None:
+			decoder = None
+		elif value_decoder in struct_formats:
+			decoder_struct = get_struct(struct_formats[value_decoder])
+			unpack_from = decoder_struct.unpack_from
+			min_size = params_size + decoder_struct.size
+
+			def decoder(data):
+				if len(data) < min_size:
+					return None
+
+				return unpack_from(data, params_size)[0]
+		else:
+			def decoder(data):
+				if len(data) < params_size:
+					return None
+
+				try:
+					return value_decoder(data[params_size:])
+				except (IndexError, ValueError, struct.error):
+					# UnicodeDecodeError is a ValueError
+					return None
+
+		return (encoder, decoder, params_encoder)
 
 	def __init__(self, parent, dev_id, initial_props):
 		self.id = dev_id
 		self.ports = []
 		self.client = parent
+		self.streams = []
+		self.property_cache = dict()
 		self.valid_properties = list(self._property_encoding)
 
 		for prop_id, prop_bytes in initial_props:
@@ -39,55 +123,102 @@ class AxiDevice:
 	def receive_measurement(self, data):
 		return None
 
-	async def set_property(self, prop_id, value, params=dict()):
-		prop_encoding = self._property_encoding.get(prop_id, None)
-		_, prop_params = self._property_params.get(prop_id, (0, []))
-		value_bytes = b""
+	def measurements(self, maxsize=1024, batch=None, policy=DropPolicy.BLOCK, gaps=False):
+		# Returns an async iterator that yields lists of at most batch measurements received from this device,
+		# close() must be called, or the iterator used as an async context manager, once it's no longer needed
+		# If gaps is True, the lists can contain MeasurementGap objects after reconnecting
+		return MeasurementStream(self, maxsize, batch, policy, gaps)
+
+	def encode_property(self, prop_id, value, params=dict()):
+		prop_codec = self._property_codecs.get(prop_id, None)
 
-		if prop_encoding == None:
+		if prop_codec == None:
 			raise ValueError("Property {0} is invalid for {1}".format(prop_id, self.__class__.__name__))
 
-		encoder, _ = prop_encoding
+		encoder, _, _ = prop_codec
 
 		if encoder == None:
 			raise ValueError("Property {0} is read-only".format(prop_id))
 
-		for param_name, param_encoder in prop_params:
-			param_value = params.get(param_name, None)
+		return encoder(value, params)
+
+	def encode_property_params(self, prop_id, params=dict()):
+		prop_codec = self._property_codecs.get(prop_id, None)
+
+		if prop_codec == None:
+			return b""
+
+		_, _, params_encoder = prop_codec
+		return params_encoder(params)
+
+	def cache_property(self, prop_id, value, success=True):
+		# Stores the last value successfully written or read, including the encoded parameters. Read-only and
+		# volatile properties can change without the client knowing, so they are never cached.
+		encoder, _ = self._property_encoding.get(prop_id, (None, None))
+
+		if encoder == None or prop_id in self._volatile_properties:
+			return
 
-			if param_value == None:
-				raise ValueError("Missing parameter: {0}".format(param_name))
+		params_size, _ = self._property_params.get(prop_id, (0, []))
+		key = (prop_id, bytes(value[:params_size]))
 
-			value_bytes += param_encoder(param_value)
+		if success:
+			self.property_cache[key] = bytes(value)
+		else:
+			self.property_cache.pop(key, None)
 
-		value_bytes += encoder(value)
+	def is_property_cached(self, prop_id, value):
+		params_size, _ = self._property_params.get(prop_id, (0, []))
+		return self.property_cache.get( (prop_id, bytes(value[:params_size])), None ) == value
+
+	def clear_property_cache(self):
+		self.property_cache = dict()
+
+	async def set_property(self, prop_id, value, params=dict(), force=False):
+		# Writing the value that is already set is skipped, unless force is True
+		value_bytes = self.encode_property(prop_id, value, params)
+
+		if not force and self.is_property_cached(prop_id, value_bytes):
+			return True
 
 		return await self.client.set_raw_property(self.id, prop_id, value_bytes)
 
-	async def get_property(self, prop_id, params=dict()):
-		prop_encoding = self._property_encoding.get(prop_id, None)
-		params_size, prop_params = self._property_params.get(prop_id, (0, []))
-		param_bytes = b""
+	def encode_property_query(self, prop_id, params=dict()):
+		# Returns (decoder, param_bytes) for reading a property, decoder takes the value returned by the server
+		prop_codec = self._property_codecs.get(prop_id, None)
 
-		if prop_encoding == None:
+		if prop_codec == None:
 			raise ValueError("Property {0} is invalid for {1}".format(prop_id, self.__class__.__name__))
 
-		_, decoder = prop_encoding
+		_, decoder, params_encoder = prop_codec
 
 		if decoder == None:
 			raise ValueError("Property {0} is write-only".format(prop_id))
 
-		for param_name, param_encoder in prop_params:
-			param_value = params.get(param_name, None)
+		return (decoder, params_encoder(params))
+
+	async def get_property(self, prop_id, params=dict(), use_cache=True):
+		decoder, param_bytes = self.encode_property_query(prop_id, params)
 
-			if param_value == None:
-				raise ValueError("Missing parameter: {0}".format(param_name))
+		if use_cache:
+			value = self.property_cache.get( (prop_id, param_bytes), None )
 
-			param_bytes += param_encoder(param_value)
+			if value != None:
+				return (True, decoder(value))
 
 		success, value = await self.client.get_raw_property(self.id, prop_id, param_bytes)
 
 		if not success:
 			return (False, None)
 
-		return (success, decoder(value[params_size:]))
+		try:
+			decoded_value = decoder(value)
+		except Exception:
+			# Malformed replies are reported as failed reads, like in get_properties
+			decoded_value = None
+
+		if decoded_value == None:
+			return (False, None)
+
+		self.cache_property(prop_id, value)
+		return (True, decoded_value)
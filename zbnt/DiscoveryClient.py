@@ -16,6 +16,7 @@
 	along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
+import time
 import socket
 import random
 import asyncio
@@ -28,20 +29,21 @@ from .MessageReceiver import *
 class DiscoveryClient(MessageReceiver):
 	MSG_DISCOVERY_PORT = 5466
 
-	def __init__(self, address_list, ip6):
+	def __init__(self, address_list, ip6, callback=None):
 		super().__init__()
 
 		self.ip6 = ip6
 		self.address_list = address_list
+		self.callback = callback
 		self.devices_found = []
 		self.address_set = set([])
 
 	@staticmethod
-	async def create(addr, ip6):
+	async def create(addr, ip6, callback=None):
 		loop = asyncio.get_running_loop()
 
 		_, protocol = await loop.create_datagram_endpoint(
-			lambda: DiscoveryClient(addr, ip6),
+			lambda: DiscoveryClient(addr, ip6, callback),
 			remote_addr=None,
 			family=socket.AF_INET6 if ip6 else socket.AF_INET,
 			allow_broadcast=True
@@ -53,11 +55,14 @@ class DiscoveryClient(MessageReceiver):
 		super().connection_made(transport)
 
 		self.validator = random.randint(0, 2**64 - 1)
+		self.probe()
 
-		message = MessageReceiver.MSG_MAGIC_IDENTIFIER
-		message += encode_u16(Messages.MSG_ID_DISCOVERY)
-		message += encode_u16(8)
-		message += encode_u64(self.validator)
+	def probe(self):
+		# Sends a new DISCOVERY message, devices that answer are reported again even if they were already found
+		self.devices_found = []
+		self.address_set = set([])
+
+		message = MessageReceiver.encode_message_header(Messages.MSG_ID_DISCOVERY, 8) + encode_u64(self.validator)
 
 		for address in self.address_list:
 			if not self.ip6:
@@ -68,9 +73,7 @@ class DiscoveryClient(MessageReceiver):
 	def datagram_received(self, data, addr):
 		self.remote_addr = addr
 		super().bytes_received(data)
-
-		self.status = MsgRxStatus.MSG_RX_MAGIC
-		self.buffer = b""
+		self.reset_receiver()
 
 	def error_received(self, err):
 		pass
@@ -82,7 +85,7 @@ class DiscoveryClient(MessageReceiver):
 		if msg_id != Messages.MSG_ID_DISCOVERY or len(msg_payload) <= 54:
 			return
 
-		validator = decode_u64(msg_payload[0:8])
+		validator = decode_u64(msg_payload)
 
 		if validator != self.validator:
 			return
@@ -92,7 +95,7 @@ class DiscoveryClient(MessageReceiver):
 		device["version"] = (
 			msg_payload[11],
 			msg_payload[10],
-			decode_u16(msg_payload[8:10]),
+			decode_u16(msg_payload, 8),
 			msg_payload[12:28].strip(b"\x00").decode("UTF-8"),
 			msg_payload[28:44].strip(b"\x00").decode("UTF-8"),
 			"d" if msg_payload[44] else ""
@@ -120,9 +123,9 @@ class DiscoveryClient(MessageReceiver):
 		device["local"] = bool(msg_payload[45])
 
 		if not device["local"]:
-			device["port"] = decode_u16(msg_payload[46:48])
+			device["port"] = decode_u16(msg_payload, 46)
 		else:
-			device["pid"] = decode_s64(msg_payload[46:54])
+			device["pid"] = decode_s64(msg_payload, 46)
 
 		device["name"] = msg_payload[54:].decode("UTF-8")
 
@@ -130,7 +133,28 @@ class DiscoveryClient(MessageReceiver):
 			self.address_set.add(ip)
 			self.devices_found.append(device)
 
-async def discover_devices(timeout, ip4=False):
+			if self.callback != None:
+				self.callback(device)
+
+	def close(self):
+		self.transport.close()
+
+# Multicast addresses resolved with getaddrinfo, indexed by (interface name, interface index)
+multicast_addresses = dict()
+
+# Results of get_discovery_addresses, indexed by ip4: (expire_time, (address4_set, address6_set))
+discovery_addresses = dict()
+discovery_addresses_ttl = 5
+
+def get_discovery_addresses(ip4=False):
+	# Interfaces are enumerated again once the previous result is older than discovery_addresses_ttl seconds,
+	# so that interfaces and addresses added or removed are picked up without doing it for every probe
+	now = time.monotonic()
+	cached = discovery_addresses.get(ip4, None)
+
+	if cached != None and cached[0] > now:
+		return cached[1]
+
 	address4_set = set(["127.0.0.1"])
 	address6_set = set([])
 
@@ -146,12 +170,31 @@ async def discover_devices(timeout, ip4=False):
 						elif addr["addr"][:8] == "169.254.":
 							address4_set.add("169.254.255.255")
 
-		address6_set.add(
-			socket.getaddrinfo(
+		try:
+			key = (iface, socket.if_nametoindex(iface))
+		except OSError:
+			# Interface has been removed
+			continue
+
+		address = multicast_addresses.get(key, None)
+
+		if address == None:
+			address = socket.getaddrinfo(
 				"ff12::{0}%{1}".format(DiscoveryClient.MSG_DISCOVERY_PORT, iface),
 				5466, socket.AF_INET6, socket.SOCK_DGRAM
 			)[0][-1]
-		)
+
+			multicast_addresses[key] = address
+
+		address6_set.add(address)
+
+	result = (frozenset(address4_set), frozenset(address6_set))
+	discovery_addresses[ip4] = (now + discovery_addresses_ttl, result)
+
+	return result
+
+async def discover_devices(timeout, ip4=False):
+	address4_set, address6_set = get_discovery_addresses(ip4)
 
 	# Broadcast DISCOVERY message on every interface
 
@@ -160,4 +203,46 @@ async def discover_devices(timeout, ip4=False):
 
 	await asyncio.sleep(timeout)
 
+	ip4_client.close()
+	ip6_client.close()
+
 	return ip4_client.devices_found + ip6_client.devices_found
+
+async def discover_devices_iter(timeout, ip4=False, count=None, match=None, quiet_time=None):
+	# Yields devices as soon as they answer, stops after timeout seconds, once count devices have been found,
+	# or when no device has answered in quiet_time seconds since the last one. If set, only devices for which
+	# match(device) returns True are yielded.
+
+	loop = asyncio.get_running_loop()
+	queue = asyncio.Queue()
+	address4_set, address6_set = get_discovery_addresses(ip4)
+
+	ip4_client = await DiscoveryClient.create(address4_set, False, queue.put_nowait)
+	ip6_client = await DiscoveryClient.create(address6_set, True, queue.put_nowait)
+
+	deadline = loop.time() + timeout
+	found = 0
+
+	try:
+		while count == None or found < count:
+			wait_time = deadline - loop.time()
+
+			if quiet_time != None and found != 0:
+				wait_time = min(wait_time, quiet_time)
+
+			if wait_time <= 0:
+				break
+
+			try:
+				device = await asyncio.wait_for(queue.get(), wait_time)
+			except asyncio.TimeoutError:
+				break
+
+			if match != None and not match(device):
+				continue
+
+			found += 1
+			yield device
+	finally:
+		ip4_client.close()
+		ip6_client.close()
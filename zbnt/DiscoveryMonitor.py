@@ -0,0 +1,115 @@
+"""
+	zbnt/python-client
+	Copyright (C) 2022 Oscar R.
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+
+from enum import Enum, auto
+
+from .DiscoveryService import *
+
+class DiscoveryEvent(Enum):
+	APPEARED = auto()
+	DISAPPEARED = auto()
+	VERSION_CHANGED = auto()
+
+class DiscoveryMonitor(DiscoveryService):
+	# Probes the network periodically and calls callback(event, device) for every subscriber when a device
+	# appears, stops answering or changes its version. Devices are identified by (address, pid).
+	# The probe interval is doubled after every probe that finds no changes, up to max_interval, and goes back
+	# to min_interval as soon as something changes.
+
+	def __init__(self, ip4=False, min_interval=1, max_interval=30, reply_timeout=0.5, max_missed=2):
+		super().__init__(ip4)
+
+		self.min_interval = min_interval
+		self.max_interval = max_interval
+		self.reply_timeout = reply_timeout
+		self.max_missed = max_missed
+		self.interval = min_interval
+
+		self.known = dict()
+		self.seen = set([])
+		self.changed = False
+		self.subscribers = []
+
+	def __repr__(self):
+		return f"DiscoveryMonitor(devices={len(self.known)}, interval={self.interval})"
+
+	async def start(self):
+		await super().start()
+
+		if self.refresh_task == None:
+			self.refresh_task = asyncio.create_task(self.monitor_loop())
+
+	def subscribe(self, callback):
+		self.subscribers.append(callback)
+
+	def unsubscribe(self, callback):
+		self.subscribers = [s for s in self.subscribers if s != callback]
+
+	def notify(self, event, device):
+		self.changed = True
+
+		for callback in self.subscribers:
+			callback(event, device)
+
+	def get_devices(self):
+		return [device for device, _ in self.known.values()]
+
+	def device_received(self, device):
+		super().device_received(device)
+
+		key = (device["address"], device.get("pid", None))
+		old_device, _ = self.known.get(key, (None, 0))
+
+		self.known[key] = (device, 0)
+		self.seen.add(key)
+
+		if old_device == None:
+			self.notify(DiscoveryEvent.APPEARED, device)
+		elif old_device["version"] != device["version"]:
+			self.notify(DiscoveryEvent.VERSION_CHANGED, device)
+
+	def check_missing(self):
+		for key, (device, missed) in list(self.known.items()):
+			if key in self.seen:
+				continue
+
+			if missed + 1 >= self.max_missed:
+				del self.known[key]
+				self.notify(DiscoveryEvent.DISAPPEARED, device)
+			else:
+				self.known[key] = (device, missed + 1)
+
+	async def monitor_loop(self):
+		# The first probe is sent when the sockets are created
+		while True:
+			await asyncio.sleep(self.reply_timeout)
+
+			self.check_missing()
+
+			if self.changed:
+				self.interval = self.min_interval
+			else:
+				self.interval = min(self.interval * 2, self.max_interval)
+
+			await asyncio.sleep(max(self.interval - self.reply_timeout, 0))
+
+			self.seen = set([])
+			self.changed = False
+			self.send_probe()
@@ -0,0 +1,110 @@
+"""
+	zbnt/python-client
+	Copyright (C) 2022 Oscar R.
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+
+from .DiscoveryClient import *
+
+class DiscoveryService:
+	# Keeps the discovery sockets open between calls and remembers every device that answered in the last
+	# ttl seconds, so that later calls can be answered without waiting for the network
+
+	def __init__(self, ip4=False, ttl=30):
+		self.ip4 = ip4
+		self.ttl = ttl
+		self.clients = []
+		self.devices = dict()
+		self.refresh_task = None
+
+	def __repr__(self):
+		return f"DiscoveryService(devices={len(self.devices)}, ttl={self.ttl})"
+
+	async def start(self, refresh_interval=None):
+		# If refresh_interval is set, the network is probed again every refresh_interval seconds
+		if len(self.clients) == 0:
+			address4_set, address6_set = get_discovery_addresses(self.ip4)
+
+			self.clients = [
+				await DiscoveryClient.create(address4_set, False, self.device_received),
+				await DiscoveryClient.create(address6_set, True, self.device_received)
+			]
+
+		if refresh_interval != None and self.refresh_task == None:
+			self.refresh_task = asyncio.create_task(self.refresh_loop(refresh_interval))
+
+	def close(self):
+		if self.refresh_task != None:
+			self.refresh_task.cancel()
+			self.refresh_task = None
+
+		for client in self.clients:
+			client.close()
+
+		self.clients = []
+
+	async def __aenter__(self):
+		await self.start()
+		return self
+
+	async def __aexit__(self, exc_type, exc, tb):
+		self.close()
+
+	def device_received(self, device):
+		key = (device["address"], device.get("pid", None))
+		self.devices[key] = (device, asyncio.get_running_loop().time())
+
+	def get_devices(self):
+		# Returns the devices that answered in the last ttl seconds
+		expire_time = asyncio.get_running_loop().time() - self.ttl
+
+		for key, (_, timestamp) in list(self.devices.items()):
+			if timestamp < expire_time:
+				del self.devices[key]
+
+		return [device for device, _ in self.devices.values()]
+
+	def send_probe(self):
+		# Interfaces added or removed are picked up once the addresses cached by get_discovery_addresses expire
+		address4_set, address6_set = get_discovery_addresses(self.ip4)
+		self.clients[0].address_list = address4_set
+		self.clients[1].address_list = address6_set
+
+		for client in self.clients:
+			client.probe()
+
+	async def probe(self, timeout):
+		await self.start()
+
+		self.send_probe()
+		await asyncio.sleep(timeout)
+		return self.get_devices()
+
+	async def discover(self, timeout, refresh=False):
+		# Answers from the cache if it has any device, probes the network otherwise
+		if not refresh:
+			devices = self.get_devices()
+
+			if len(devices) != 0:
+				return devices
+
+		return await self.probe(timeout)
+
+	async def refresh_loop(self, interval):
+		while True:
+			await self.probe(0)
+			await asyncio.sleep(interval)
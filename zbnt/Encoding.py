@@ -18,40 +18,143 @@
 
 import struct
 
+# Every format string is compiled only once, formats without byte order prefix are little endian
+
+struct_cache = dict()
+
+def get_struct(fmt):
+	s = struct_cache.get(fmt, None)
+
+	if s == None:
+		s = struct.Struct(fmt if fmt[:1] in "<>!=@" else "<" + fmt)
+		struct_cache[fmt] = s
+
+	return s
+
+def pack(fmt, *values):
+	return get_struct(fmt).pack(*values)
+
+def pack_into(fmt, buffer, offset, *values):
+	get_struct(fmt).pack_into(buffer, offset, *values)
+
+def unpack_from(fmt, buffer, offset=0):
+	return get_struct(fmt).unpack_from(buffer, offset)
+
+def iter_unpack(fmt, buffer):
+	# Unpacks consecutive records, trailing bytes that don't form a complete record are ignored
+	s = get_struct(fmt)
+	return s.iter_unpack(memoryview(buffer)[:len(buffer) - len(buffer) % s.size])
+
+class Schema:
+	# Fixed size record made of named fields, e.g. Schema([("time", "Q"), ("number", "I")])
+
+	_numpy_types = {
+		"?": "b1", "b": "i1", "B": "u1", "h": "i2", "H": "u2", "i": "i4", "I": "u4",
+		"q": "i8", "Q": "u8", "f": "f4", "d": "f8"
+	}
+
+	def __init__(self, fields):
+		self.fields = fields
+		self.names = tuple(name for name, _ in fields)
+		self.struct = get_struct("".join(fmt for _, fmt in fields))
+		self.size = self.struct.size
+
+	def __repr__(self):
+		return f"Schema({self.fields})"
+
+	@property
+	def dtype(self):
+		# NumPy structured dtype with the same layout
+		return [(name, "<" + Schema._numpy_types[fmt]) for name, fmt in self.fields]
+
+	def encode(self, *values):
+		return self.struct.pack(*values)
+
+	def encode_into(self, buffer, offset, *values):
+		self.struct.pack_into(buffer, offset, *values)
+
+	def decode(self, data, offset=0):
+		return self.struct.unpack_from(data, offset)
+
+	def decode_dict(self, data, offset=0):
+		return dict(zip(self.names, self.struct.unpack_from(data, offset)))
+
+	def encode_all(self, records):
+		records = list(records)
+		buffer = bytearray(self.size * len(records))
+
+		for i, record in enumerate(records):
+			self.struct.pack_into(buffer, i * self.size, *record)
+
+		return bytes(buffer)
+
+	def decode_all(self, data):
+		# Returns an iterator of tuples, one for each complete record in data
+		return self.struct.iter_unpack(memoryview(data)[:len(data) - len(data) % self.size])
+
+bool_struct = get_struct("?")
+u8_struct = get_struct("B")
+u16_struct = get_struct("H")
+u32_struct = get_struct("I")
+u64_struct = get_struct("Q")
+s8_struct = get_struct("b")
+s16_struct = get_struct("h")
+s32_struct = get_struct("i")
+s64_struct = get_struct("q")
+float_struct = get_struct("f")
+double_struct = get_struct("d")
+
+def pack_int(int_struct, *values):
+	# Raises the same exception as int.to_bytes for values out of range
+	try:
+		return int_struct.pack(*values)
+	except struct.error as e:
+		if all(isinstance(v, int) for v in values):
+			raise OverflowError(str(e)) from None
+
+		raise
+
+def unpack_int(int_struct, signed, value, offset):
+	# Buffers shorter than the integer are decoded like int.from_bytes does
+	if len(value) - offset < int_struct.size:
+		return int.from_bytes(value[offset:offset + int_struct.size], byteorder="little", signed=signed)
+
+	return int_struct.unpack_from(value, offset)[0]
+
 # encode_x : number to bytes
 
 def encode_bool(value):
-	return bool(value).to_bytes(1, byteorder="little", signed=False)
+	return bool_struct.pack(bool(value))
 
 def encode_u8(value):
-	return value.to_bytes(1, byteorder="little", signed=False)
+	return pack_int(u8_struct, value)
 
 def encode_u16(value):
-	return value.to_bytes(2, byteorder="little", signed=False)
+	return pack_int(u16_struct, value)
 
 def encode_u32(value):
-	return value.to_bytes(4, byteorder="little", signed=False)
+	return pack_int(u32_struct, value)
 
 def encode_u64(value):
-	return value.to_bytes(8, byteorder="little", signed=False)
+	return pack_int(u64_struct, value)
 
 def encode_s8(value):
-	return value.to_bytes(1, byteorder="little", signed=True)
+	return pack_int(s8_struct, value)
 
 def encode_s16(value):
-	return value.to_bytes(2, byteorder="little", signed=True)
+	return pack_int(s16_struct, value)
 
 def encode_s32(value):
-	return value.to_bytes(4, byteorder="little", signed=True)
+	return pack_int(s32_struct, value)
 
 def encode_s64(value):
-	return value.to_bytes(8, byteorder="little", signed=True)
+	return pack_int(s64_struct, value)
 
 def encode_float(value):
-	return struct.pack("<f", value)
+	return float_struct.pack(value)
 
 def encode_double(value):
-	return struct.pack("<d", value)
+	return double_struct.pack(value)
 
 def encode_str(value):
 	return value.encode("UTF-8")
@@ -60,49 +163,64 @@ def encode_mac(value):
 	return bytes.fromhex(value.replace(":", "").replace(" ", ""))
 
 def encode_ip4(value):
-	return b"".join(map(lambda x: encode_u8(int(x)), value.split(".")[::-1]))
+	return bytes(int(x) for x in reversed(value.split(".")))
 
-# decode_x : bytes to number
+# decode_x : bytes to number, starting at offset
 
-def decode_bool(value):
-	return bool(value[0])
+def decode_bool(value, offset=0):
+	return bool(value[offset])
 
-def decode_u8(value):
-	return int.from_bytes(value[:1], byteorder="little", signed=False)
+def decode_u8(value, offset=0):
+	return unpack_int(u8_struct, False, value, offset)
 
-def decode_u16(value):
-	return int.from_bytes(value[:2], byteorder="little", signed=False)
+def decode_u16(value, offset=0):
+	return unpack_int(u16_struct, False, value, offset)
 
-def decode_u32(value):
-	return int.from_bytes(value[:4], byteorder="little", signed=False)
+def decode_u32(value, offset=0):
+	return unpack_int(u32_struct, False, value, offset)
 
-def decode_u64(value):
-	return int.from_bytes(value[:8], byteorder="little", signed=False)
+def decode_u64(value, offset=0):
+	return unpack_int(u64_struct, False, value, offset)
 
-def decode_s8(value):
-	return int.from_bytes(value[:1], byteorder="little", signed=True)
+def decode_s8(value, offset=0):
+	return unpack_int(s8_struct, True, value, offset)
 
-def decode_s16(value):
-	return int.from_bytes(value[:2], byteorder="little", signed=True)
+def decode_s16(value, offset=0):
+	return unpack_int(s16_struct, True, value, offset)
 
-def decode_s32(value):
-	return int.from_bytes(value[:4], byteorder="little", signed=True)
+def decode_s32(value, offset=0):
+	return unpack_int(s32_struct, True, value, offset)
 
-def decode_s64(value):
-	return int.from_bytes(value[:8], byteorder="little", signed=True)
+def decode_s64(value, offset=0):
+	return unpack_int(s64_struct, True, value, offset)
 
-def decode_float(value):
-	return struct.unpack("<f", value)[0]
+def decode_float(value, offset=0):
+	return float_struct.unpack_from(value, offset)[0]
 
-def decode_double(value):
-	return struct.unpack("<d", value)[0]
+def decode_double(value, offset=0):
+	return double_struct.unpack_from(value, offset)[0]
 
 def decode_str(value):
-	return value.encode("UTF-8")
+	return bytes(value).decode("UTF-8")
 
 def decode_mac(value):
-	hex_mac = value.hex().upper()
-	return ":".join([hex_mac[i:i+1] for i in range(0, len(hex_mac), 2)])
+	return bytes(value).hex(":").upper()
 
 def decode_ip4(value):
 	return "{0}.{1}.{2}.{3}".format(value[3], value[2], value[1], value[0])
+
+# Struct format of every fixed size encoder and decoder, used by AxiDevice to compile property codecs
+
+struct_formats = {
+	encode_bool: "?", decode_bool: "?",
+	encode_u8: "B", decode_u8: "B",
+	encode_u16: "H", decode_u16: "H",
+	encode_u32: "I", decode_u32: "I",
+	encode_u64: "Q", decode_u64: "Q",
+	encode_s8: "b", decode_s8: "b",
+	encode_s16: "h", decode_s16: "h",
+	encode_s32: "i", decode_s32: "i",
+	encode_s64: "q", decode_s64: "q",
+	encode_float: "f", decode_float: "f",
+	encode_double: "d", decode_double: "d"
+}
@@ -87,3 +87,9 @@ class Devices(IntEnum):
 	DEV_LATENCY_MEASURER = auto()
 	DEV_TRAFFIC_GENERATOR = auto()
 	DEV_PR_CONTROLLER = auto()
+
+# Lookup tables indexed by raw id, decoders use table.get(value, value) so that unknown ids are kept as ints
+
+messages_by_id = {msg_id.value: msg_id for msg_id in Messages}
+properties_by_id = {prop_id.value: prop_id for prop_id in Properties}
+devices_by_id = {dev_type.value: dev_type for dev_type in Devices}
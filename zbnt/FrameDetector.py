@@ -31,7 +31,7 @@ class FrameDetector(AxiDevice):
 		Properties.PROP_ENABLE: (encode_bool, decode_bool),
 		Properties.PROP_ENABLE_LOG: (encode_bool, decode_bool),
 		Properties.PROP_ENABLE_SCRIPT: (encode_u32, decode_u32),
-		Properties.PROP_OVERFLOW_COUNT: (None, lambda x: (decode_u64(x[:8]), decode_u64(x[8:16]))),
+		Properties.PROP_OVERFLOW_COUNT: (None, lambda x: unpack_from("QQ", x) if len(x) >= 16 else None),
 		Properties.PROP_FRAME_SCRIPT: (lambda x: x, lambda x: x),
 		Properties.PROP_FRAME_SCRIPT_NAME: (encode_str, decode_str)
 	}
@@ -46,6 +46,13 @@ class FrameDetector(AxiDevice):
 		])
 	}
 
+	# Frames have a variable size payload after this header, so there is no _measurement_dtype
+	_measurement_schema = Schema([
+		("time", "Q"), ("number", "I"), ("flags", "B"), ("log_width", "B"), ("match_mask", "B")
+	])
+
+	_measurement_struct = _measurement_schema.struct
+
 	_regex_comp_instr = re.compile("^(?:nop|(s?[lg]tq?|eq|or|and)(8|16|24|32|40|48|56|64|[fd])(l?)|eof)$")
 	_regex_edit_instr = re.compile("^(?:nop|setr|(set|(?:xn|x)?or|and|add|s?mul)(8|16|32|64|[fd])(l?)|drop|corrupt)$")
 
@@ -71,6 +78,9 @@ class FrameDetector(AxiDevice):
 		HAS_FPU       = 8
 
 	class Frame:
+		__slots__ = ("time", "number", "direction", "flags", "match", "payload")
+		fields = __slots__
+
 		def __init__(self, time, number, direction, flags, match, payload):
 			self.time = time
 			self.number = number
@@ -82,6 +92,10 @@ class FrameDetector(AxiDevice):
 		def __repr__(self):
 			return f"FrameDetector.Frame(number={self.number}, time={self.time}, direction={self.direction}, match={self.match}, flags={self.flags}, captured_size={len(self.payload)})"
 
+		def astuple(self):
+			# Payload is returned as a copy, self.payload might be a view of the receive buffer
+			return (self.time, self.number, self.direction, self.flags, self.match, bytes(self.payload))
+
 	def __init__(self, parent, dev_id, initial_props):
 		super().__init__(parent, dev_id, initial_props)
 
@@ -103,20 +117,16 @@ class FrameDetector(AxiDevice):
 					self.extr_fifo_size = decode_u32(prop_bytes[4:8])
 
 	def receive_measurement(self, data):
-		if len(data) < 15:
+		if len(data) < FrameDetector._measurement_struct.size:
 			return None
 
-		time = decode_u64(data[0:8])
-		number = decode_u32(data[8:12])
-		direction = data[12] & 1
-		flags = data[12] >> 1
-		log_width = data[13]
-		match_mask = data[14]
+		time, number, flags, log_width, match_mask = FrameDetector._measurement_struct.unpack_from(data)
 
+		# Payload is kept as a view of the received message, bytes(frame.payload) returns a copy
 		ext_offset = ((log_width + 23) // log_width) * log_width - 8
-		ext_data = data[ext_offset:]
+		ext_data = memoryview(data)[ext_offset:]
 
-		return FrameDetector.Frame(time, number, direction, flags, match_mask, ext_data)
+		return FrameDetector.Frame(time, number, flags & 1, flags >> 1, match_mask, ext_data)
 
 	def load_script(self, path):
 		comparator_instr = [(0, 0)] * self.max_script_size
@@ -45,7 +45,20 @@ class LatencyMeasurer(AxiDevice):
 		])
 	}
 
+	_measurement_schema = Schema([
+		("time", "Q"),
+		("number", "Q"),
+		("ping", "I"), ("pong", "I"),
+		("lost_pings", "Q"), ("lost_pongs", "Q")
+	])
+
+	_measurement_struct = _measurement_schema.struct
+	_measurement_dtype = _measurement_schema.dtype
+
 	class Measurement:
+		__slots__ = ("time", "number", "ping", "pong", "lost_pings", "lost_pongs")
+		fields = __slots__
+
 		def __init__(self, time, number, ping, pong, lost_pings, lost_pongs):
 			self.time = time
 			self.number = number
@@ -57,20 +70,14 @@ class LatencyMeasurer(AxiDevice):
 		def __repr__(self):
 			return f"LatencyMeasurer.Measurement(time={self.time}, number={self.number}, latency=({self.ping}, {self.pong}), lost=({self.lost_pings}, {self.lost_pongs}))"
 
+		def astuple(self):
+			return (self.time, self.number, self.ping, self.pong, self.lost_pings, self.lost_pongs)
+
 	def __init__(self, parent, dev_id, initial_props):
 		super().__init__(parent, dev_id, initial_props)
 
 	def receive_measurement(self, data):
-		if len(data) < 40:
+		if len(data) < LatencyMeasurer._measurement_struct.size:
 			return None
 
-		time = decode_u64(data[0:8])
-
-		num_pings = decode_u64(data[8:16])
-		ping_time = decode_u32(data[16:20])
-		pong_time = decode_u32(data[20:24])
-
-		num_lost_pings = decode_u64(data[24:32])
-		num_lost_pongs = decode_u64(data[32:40])
-
-		return LatencyMeasurer.Measurement(time, num_pings, ping_time, pong_time, num_lost_pings, num_lost_pongs)
+		return LatencyMeasurer.Measurement(*LatencyMeasurer._measurement_struct.unpack_from(data))
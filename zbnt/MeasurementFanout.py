@@ -0,0 +1,222 @@
+"""
+	zbnt/python-client
+	Copyright (C) 2022 Oscar R.
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import time
+import threading
+import multiprocessing
+
+from multiprocessing import shared_memory
+
+from .ZbntClient import *
+
+class SharedRing:
+	# Single producer, single consumer ring buffer of (dev_id, payload) records in shared memory
+	# Layout: write position (8 bytes) + read position (8 bytes) + data, positions never wrap around
+
+	_positions_struct = get_struct("QQ")
+	_position_struct = get_struct("Q")
+	_record_struct = get_struct("HI")
+
+	PADDING_ID = 0xFFFF
+
+	def __init__(self, size=None, name=None):
+		if name == None:
+			self.shm = shared_memory.SharedMemory(create=True, size=SharedRing._positions_struct.size + size)
+			self.shm.buf[:SharedRing._positions_struct.size] = bytes(SharedRing._positions_struct.size)
+			self.owner = True
+		else:
+			self.shm = shared_memory.SharedMemory(name=name)
+			self.owner = False
+
+		self.name = self.shm.name
+		self.data = self.shm.buf[SharedRing._positions_struct.size:]
+		self.capacity = len(self.data)
+
+	def __repr__(self):
+		return f"SharedRing(name={self.name}, capacity={self.capacity})"
+
+	def put(self, dev_id, payload):
+		# Returns False if there is not enough free space for the record
+		write_pos, read_pos = SharedRing._positions_struct.unpack_from(self.shm.buf)
+		record_size = SharedRing._record_struct.size + len(payload)
+		offset = write_pos % self.capacity
+		tail = self.capacity - offset
+		padding = 0
+
+		if tail < record_size:
+			# Records are never split, skip to the beginning of the buffer
+			padding = tail
+
+		if self.capacity - (write_pos - read_pos) < padding + record_size:
+			return False
+
+		if padding != 0:
+			if padding >= SharedRing._record_struct.size:
+				SharedRing._record_struct.pack_into(self.data, offset, SharedRing.PADDING_ID, 0)
+
+			offset = 0
+
+		SharedRing._record_struct.pack_into(self.data, offset, dev_id, len(payload))
+		offset += SharedRing._record_struct.size
+		self.data[offset:offset + len(payload)] = payload
+
+		# Publish the record only after it has been completely written
+		SharedRing._position_struct.pack_into(self.shm.buf, 0, write_pos + padding + record_size)
+		return True
+
+	def get_all(self):
+		write_pos, read_pos = SharedRing._positions_struct.unpack_from(self.shm.buf)
+		records = []
+
+		while read_pos < write_pos:
+			offset = read_pos % self.capacity
+			tail = self.capacity - offset
+
+			if tail < SharedRing._record_struct.size:
+				read_pos += tail
+				continue
+
+			dev_id, size = SharedRing._record_struct.unpack_from(self.data, offset)
+
+			if dev_id == SharedRing.PADDING_ID:
+				read_pos += tail
+				continue
+
+			offset += SharedRing._record_struct.size
+			records.append( (dev_id, bytes(self.data[offset:offset + size])) )
+			read_pos += SharedRing._record_struct.size + size
+
+		SharedRing._position_struct.pack_into(self.shm.buf, 8, read_pos)
+		return records
+
+	def close(self):
+		self.data.release()
+		self.shm.close()
+
+		if self.owner:
+			self.shm.unlink()
+
+class MeasurementFanout:
+	# Copies raw measurements into one shared memory ring per worker process, devices are assigned to workers
+	# by dev_id. Each worker calls target(stream), where stream is an iterator of (device, measurement)
+	# tuples that ends once the fan-out is stopped.
+
+	def __init__(self, client, target, workers=None, ring_size=16777216, poll_interval=0.001):
+		self.client = client
+		self.target = target
+		self.num_workers = workers or multiprocessing.cpu_count()
+		self.ring_size = ring_size
+		self.poll_interval = poll_interval
+		self.rings = []
+		self.processes = []
+		self.dropped = dict()
+		self.stop_event = None
+
+		# In threaded mode, put_measurement runs in the reader thread and may still be called after unsubscribing
+		self.rings_lock = threading.Lock()
+
+	def __repr__(self):
+		return f"MeasurementFanout(workers={self.num_workers}, running={len(self.processes) != 0})"
+
+	def start(self):
+		if len(self.processes):
+			raise Exception("Fan-out already started")
+
+		self.stop_event = multiprocessing.Event()
+		rings = [SharedRing(self.ring_size) for _ in range(self.num_workers)]
+
+		for i, ring in enumerate(rings):
+			device_table = [d for d in self.client.device_table if d[0] % self.num_workers == i]
+
+			process = multiprocessing.Process(
+				target=MeasurementFanout.worker_main,
+				args=(ring.name, device_table, self.target, self.stop_event, self.poll_interval),
+				daemon=True
+			)
+
+			process.start()
+			self.processes.append(process)
+
+		with self.rings_lock:
+			self.rings = rings
+
+		self.client.subscribe(self.put_measurement, threadsafe=True, raw=True)
+
+	def stop(self, timeout=None):
+		# Workers process every measurement already in their ring before exiting
+		self.client.unsubscribe(self.put_measurement)
+
+		# Once the rings are detached no other thread can write to them
+		with self.rings_lock:
+			rings = self.rings
+			self.rings = []
+
+		if self.stop_event != None:
+			self.stop_event.set()
+
+		for process in self.processes:
+			process.join(timeout)
+
+		for ring in rings:
+			ring.close()
+
+		self.processes = []
+
+	def put_measurement(self, dev_obj, msg_payload):
+		with self.rings_lock:
+			if len(self.rings) == 0:
+				return
+
+			if not self.rings[dev_obj.id % self.num_workers].put(dev_obj.id, msg_payload):
+				self.dropped[dev_obj.id] = self.dropped.get(dev_obj.id, 0) + 1
+
+	@staticmethod
+	def worker_main(ring_name, device_table, target, stop_event, poll_interval):
+		ring = SharedRing(name=ring_name)
+		devices = dict()
+
+		for dev_id, dev_type, initial_props in device_table:
+			devices[dev_id] = ZbntClient.device_classes.get(dev_type, AxiDevice)(None, dev_id, initial_props)
+
+		try:
+			target(MeasurementFanout.worker_stream(ring, devices, stop_event, poll_interval))
+		finally:
+			ring.close()
+
+	@staticmethod
+	def worker_stream(ring, devices, stop_event, poll_interval):
+		while True:
+			stopping = stop_event.is_set()
+			records = ring.get_all()
+
+			for dev_id, payload in records:
+				dev_obj = devices.get(dev_id, None)
+
+				if dev_obj == None:
+					continue
+
+				meas_obj = dev_obj.receive_measurement(payload)
+
+				if meas_obj != None:
+					yield (dev_obj, meas_obj)
+
+			if len(records) == 0:
+				if stopping:
+					return
+
+				time.sleep(poll_interval)
@@ -0,0 +1,186 @@
+"""
+	zbnt/python-client
+	Copyright (C) 2022 Oscar R.
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+
+from enum import Enum, auto
+from collections import deque
+
+class DropPolicy(Enum):
+	BLOCK = auto()
+	DROP_OLDEST = auto()
+	DROP_NEWEST = auto()
+
+class MeasurementGap:
+	# Passed to measurement consumers instead of a measurement after a lost connection has been restored,
+	# measurements produced between lost_time and restored_time are missing
+
+	__slots__ = ("lost_time", "restored_time", "run_restarted")
+
+	def __init__(self, lost_time, restored_time, run_restarted):
+		self.lost_time = lost_time
+		self.restored_time = restored_time
+		self.run_restarted = run_restarted
+
+	def __repr__(self):
+		return f"MeasurementGap(duration={self.restored_time - self.lost_time:.3f}, run_restarted={self.run_restarted})"
+
+class MeasurementQueue:
+	def __init__(self, client, maxsize, low_watermark=None, policy=DropPolicy.BLOCK):
+		if maxsize <= 0:
+			raise ValueError("Queue size must be a positive integer")
+
+		self.client = client
+		self.maxsize = maxsize
+		self.low_watermark = maxsize // 2 if low_watermark == None else low_watermark
+		self.policy = policy
+
+		self.items = deque()
+		self.dropped = dict()
+		self.delayed = dict()
+		self.paused = False
+		self.closed = False
+		self.unfinished = 0
+		self.getter = None
+		self.joiners = []
+
+	def __repr__(self):
+		return f"MeasurementQueue(size={len(self.items)}, maxsize={self.maxsize}, policy={self.policy.name})"
+
+	def __len__(self):
+		return len(self.items)
+
+	def put(self, device, measurement):
+		if len(self.items) >= self.maxsize:
+			if self.policy == DropPolicy.DROP_NEWEST:
+				self.dropped[device.id] = self.dropped.get(device.id, 0) + 1
+				return
+
+			if self.policy == DropPolicy.DROP_OLDEST:
+				old_device, _ = self.items.popleft()
+				self.dropped[old_device.id] = self.dropped.get(old_device.id, 0) + 1
+				self.unfinished -= 1
+			else:
+				# Data can't be dropped, stop parsing and reading from the socket until the consumer catches up,
+				# the client stops after the current message so the queue grows past maxsize by at most one item
+				self.delayed[device.id] = self.delayed.get(device.id, 0) + 1
+
+				if not self.paused:
+					self.paused = True
+					self.client.pause_reading(self)
+
+		self.items.append( (device, measurement) )
+		self.unfinished += 1
+
+		if self.getter != None and not self.getter.done():
+			self.getter.set_result(None)
+
+	async def get(self, max_items=None):
+		# Returns a list of (device, measurement) tuples, waits until at least one is available or the
+		# queue is closed
+		while len(self.items) == 0:
+			if self.closed:
+				return []
+
+			self.getter = asyncio.get_running_loop().create_future()
+
+			try:
+				await self.getter
+			finally:
+				self.getter = None
+
+		if max_items == None or max_items >= len(self.items):
+			batch = list(self.items)
+			self.items.clear()
+		else:
+			batch = [self.items.popleft() for _ in range(max_items)]
+
+		if self.paused and len(self.items) <= self.low_watermark:
+			self.paused = False
+			self.client.resume_reading(self)
+
+		return batch
+
+	def task_done(self, count=1):
+		self.unfinished -= count
+
+		if self.unfinished <= 0:
+			self.unfinished = 0
+
+			for future in self.joiners:
+				if not future.done():
+					future.set_result(None)
+
+			self.joiners = []
+
+	async def join(self):
+		# Waits until every measurement in the queue has been processed
+		if self.unfinished == 0:
+			return
+
+		future = asyncio.get_running_loop().create_future()
+		self.joiners.append(future)
+		await future
+
+	def close(self):
+		self.closed = True
+
+		if self.paused:
+			self.paused = False
+			self.client.resume_reading(self)
+
+		if self.getter != None and not self.getter.done():
+			self.getter.set_result(None)
+
+class MeasurementStream:
+	def __init__(self, device, maxsize, batch, policy, gaps=False):
+		self.device = device
+		self.batch = batch
+		self.gaps = gaps
+		self.queue = MeasurementQueue(device.client, maxsize, policy=policy)
+
+		device.streams.append(self)
+		device.client.update_routes()
+
+	def __repr__(self):
+		return f"MeasurementStream(device={self.device}, queue={self.queue})"
+
+	def __aiter__(self):
+		return self
+
+	async def __anext__(self):
+		items = await self.queue.get(self.batch)
+
+		if len(items) == 0:
+			raise StopAsyncIteration
+
+		self.queue.task_done(len(items))
+		return [meas_obj for _, meas_obj in items]
+
+	async def __aenter__(self):
+		return self
+
+	async def __aexit__(self, exc_type, exc, tb):
+		self.close()
+
+	def close(self):
+		if self in self.device.streams:
+			self.device.streams.remove(self)
+			self.device.client.update_routes()
+
+		self.queue.close()
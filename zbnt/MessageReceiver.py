@@ -18,88 +18,141 @@
 
 import asyncio
 
-from enum import Enum, auto
-
 from .Enums import *
 from .Encoding import *
 
-class MsgRxStatus(Enum):
-	MSG_RX_MAGIC = auto()
-	MSG_RX_HEADER = auto()
-	MSG_RX_EXTENDED_HEADER = auto()
-	MSG_RX_DATA = auto()
-
 class MessageReceiver(asyncio.Protocol):
 	MSG_MAGIC_IDENTIFIER = b"\xFFZB\x02"
 
+	RX_BUFFER_SIZE = 262144
+	RX_BUFFER_MIN_FREE = 16384
+
+	_header_struct = get_struct("HH")
+	_extended_header_struct = get_struct("I")
+
+	_message_header_struct = get_struct("4sHH")
+	_extended_message_header_struct = get_struct("4sHHI")
+
 	def __init__(self):
-		self.status = MsgRxStatus.MSG_RX_MAGIC
-		self.buffer = b""
-		self.count = 0
-		self.size = 0
-		self.id = 0
+		self.buffer = bytearray()
+		self.pending_size = 0
+		self.parsing_paused = False
+
+		self.rx_buffer = bytearray()
+		self.rx_view = memoryview(self.rx_buffer)
+		self.rx_start = 0
+		self.rx_end = 0
 
 	def connection_made(self, transport):
 		self.transport = transport
 
+	@staticmethod
+	def encode_message_header(msg_id, payload_size):
+		if payload_size > 0xFFFF:
+			return MessageReceiver._extended_message_header_struct.pack(
+				MessageReceiver.MSG_MAGIC_IDENTIFIER, Messages.MSG_ID_EXTENDED, msg_id, payload_size
+			)
+
+		return MessageReceiver._message_header_struct.pack(MessageReceiver.MSG_MAGIC_IDENTIFIER, msg_id, payload_size)
+
+	def reset_receiver(self):
+		self.buffer = bytearray()
+		self.pending_size = 0
+
+		# Unprocessed bytes are discarded, but the buffer isn't reused since views of it may still be referenced
+		self.rx_start = self.rx_end
+
 	def bytes_received(self, data):
-		for b in data:
-			b = b.to_bytes(1, "little")
-
-			if self.status == MsgRxStatus.MSG_RX_MAGIC:
-				# Magic sequence: \xFFZB\x02
-				self.buffer += b
-
-				if len(self.buffer) == len(MessageReceiver.MSG_MAGIC_IDENTIFIER):
-					if self.buffer == MessageReceiver.MSG_MAGIC_IDENTIFIER:
-						self.status = MsgRxStatus.MSG_RX_HEADER
-						self.buffer = b""
-					else:
-						self.buffer = self.buffer[1:]
-			elif self.status == MsgRxStatus.MSG_RX_HEADER:
-				# Header: message_id (2 bytes) + length (2 bytes)
-				self.buffer += b
-
-				if len(self.buffer) == 4:
-					self.id = decode_u16(self.buffer[0:2])
-					self.size = decode_u16(self.buffer[2:4])
-					self.buffer = b""
-
-					if self.id == Messages.MSG_ID_EXTENDED:
-						self.status = MsgRxStatus.MSG_RX_EXTENDED_HEADER
-						self.id = self.size
-					elif self.size == 0:
-						self.message_received(self.id, self.buffer)
-						self.status = MsgRxStatus.MSG_RX_MAGIC
-						self.buffer = b""
-					else:
-						self.status = MsgRxStatus.MSG_RX_DATA
-
-					try:
-						self.id = Messages(self.id)
-					except ValueError:
-						pass
-			elif self.status == MsgRxStatus.MSG_RX_EXTENDED_HEADER:
+		if len(self.buffer):
+			# Incomplete message from a previous chunk, wait until it can be completed
+			self.buffer += data
+
+			if len(self.buffer) < self.pending_size:
+				return
+
+			data = bytes(self.buffer)
+
+		end = self.parse_messages(data, data, 0, len(data))
+		self.buffer = bytearray(data[end:])
+
+	def parse_pending(self):
+		# Processes the messages left unparsed while parsing was paused
+		if self.parsing_paused:
+			return
+
+		if self.rx_start < self.rx_end:
+			self.rx_start = self.parse_messages(self.rx_buffer, self.rx_view, self.rx_start, self.rx_end)
+		elif len(self.buffer):
+			self.bytes_received(b"")
+
+	def get_buffer(self, sizehint):
+		used = self.rx_end - self.rx_start
+		needed = max(sizehint, self.pending_size - used, MessageReceiver.RX_BUFFER_MIN_FREE)
+
+		if len(self.rx_buffer) - self.rx_end < needed:
+			# Payloads already passed to message_received are views of the current buffer and may still be
+			# referenced, so the unprocessed bytes are moved to a new buffer instead of overwriting them
+			rx_buffer = bytearray(max(MessageReceiver.RX_BUFFER_SIZE, used + needed))
+			rx_buffer[:used] = self.rx_view[self.rx_start:self.rx_end]
+
+			self.rx_buffer = rx_buffer
+			self.rx_view = memoryview(rx_buffer)
+			self.rx_start = 0
+			self.rx_end = used
+
+		return self.rx_view[self.rx_end:]
+
+	def buffer_updated(self, nbytes):
+		self.rx_end += nbytes
+		self.rx_start = self.parse_messages(self.rx_buffer, self.rx_view, self.rx_start, self.rx_end)
+
+	def parse_messages(self, data, view, start, end):
+		# Returns the offset of the first byte that couldn't be processed, self.pending_size is set to the
+		# total size of the incomplete message found at that offset, if known
+		# If parsing_paused is set while processing a message, the remaining bytes are left unprocessed
+
+		magic = MessageReceiver.MSG_MAGIC_IDENTIFIER
+		magic_len = len(magic)
+		unpack_header = MessageReceiver._header_struct.unpack_from
+		unpack_extended_header = MessageReceiver._extended_header_struct.unpack_from
+		lookup_message = messages_by_id.get
+		i = start
+
+		self.pending_size = 0
+
+		while i < end and not self.parsing_paused:
+			# Magic sequence: \xFFZB\x02
+			i = data.find(magic, i, end)
+
+			if i == -1:
+				# Keep the last bytes, they might be the beginning of a magic sequence
+				return max(start, end - magic_len + 1)
+
+			# Header: message_id (2 bytes) + length (2 bytes)
+			if i + magic_len + 4 > end:
+				return i
+
+			msg_id, size = unpack_header(data, i + magic_len)
+			offset = i + magic_len + 4
+
+			if msg_id == Messages.MSG_ID_EXTENDED:
 				# Extended header: special_id (2 bytes) + real_id (2 bytes) + real_length (4 bytes)
-				self.buffer += b
-
-				if len(self.buffer) == 4:
-					self.size = decode_u32(self.buffer)
-					self.buffer = b""
-
-					if self.size == 0:
-						self.status = MsgRxStatus.MSG_RX_DATA
-					else:
-						self.message_received(self.id, self.buffer)
-						self.status = MsgRxStatus.MSG_RX_MAGIC
-						self.buffer = b""
-			else:
-				self.buffer += b
-
-				if len(self.buffer) == self.size:
-					self.message_received(self.id, self.buffer)
-					self.status = MsgRxStatus.MSG_RX_MAGIC
-					self.buffer = b""
+				if offset + 4 > end:
+					return i
+
+				msg_id = size
+				size, = unpack_extended_header(data, offset)
+				offset += 4
+
+			if offset + size > end:
+				self.pending_size = offset + size - i
+				return i
+
+			msg_id = lookup_message(msg_id, msg_id)
+			self.message_received(msg_id, view[offset:offset + size])
+			i = offset + size
+
+		return i
 
 	def message_received(self, msg_id, msg_payload):
 		pass
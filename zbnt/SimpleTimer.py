@@ -29,6 +29,9 @@ class SimpleTimer(AxiDevice):
 		Properties.PROP_TIMER_LIMIT: (encode_u64, decode_u64)
 	}
 
+	# Timer is enabled and disabled by the server when runs start and stop
+	_volatile_properties = {Properties.PROP_ENABLE}
+
 	def __init__(self, parent, dev_id, initial_props):
 		super().__init__(parent, dev_id, initial_props)
 
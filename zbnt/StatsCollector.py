@@ -30,7 +30,19 @@ class StatsCollector(AxiDevice):
 		Properties.PROP_OVERFLOW_COUNT: (None, decode_u64)
 	}
 
+	_measurement_schema = Schema([
+		("time", "Q"),
+		("tx_bytes", "Q"), ("tx_good", "Q"), ("tx_bad", "Q"),
+		("rx_bytes", "Q"), ("rx_good", "Q"), ("rx_bad", "Q")
+	])
+
+	_measurement_struct = _measurement_schema.struct
+	_measurement_dtype = _measurement_schema.dtype
+
 	class Statistics:
+		__slots__ = ("time", "tx_bytes", "tx_good", "tx_bad", "rx_bytes", "rx_good", "rx_bad")
+		fields = __slots__
+
 		def __init__(self, time, tx_bytes, tx_good, tx_bad, rx_bytes, rx_good, rx_bad):
 			self.time = time
 			self.tx_bytes = tx_bytes
@@ -43,21 +55,14 @@ class StatsCollector(AxiDevice):
 		def __repr__(self):
 			return f"StatsCollector.Statistics(time={self.time}, tx=({self.tx_bytes}, {self.tx_good}, {self.tx_bad}), rx=({self.rx_bytes}, {self.rx_good}, {self.rx_bad}))"
 
+		def astuple(self):
+			return (self.time, self.tx_bytes, self.tx_good, self.tx_bad, self.rx_bytes, self.rx_good, self.rx_bad)
+
 	def __init__(self, parent, dev_id, initial_props):
 		super().__init__(parent, dev_id, initial_props)
 
 	def receive_measurement(self, data):
-		if len(data) < 56:
+		if len(data) < StatsCollector._measurement_struct.size:
 			return None
 
-		time = decode_u64(data[0:8])
-
-		tx_bytes = decode_u64(data[8:16])
-		tx_good = decode_u64(data[16:24])
-		tx_bad = decode_u64(data[24:32])
-
-		rx_bytes = decode_u64(data[32:40])
-		rx_good = decode_u64(data[40:48])
-		rx_bad = decode_u64(data[48:56])
-
-		return StatsCollector.Statistics(time, tx_bytes, tx_good, tx_bad, rx_bytes, rx_good, rx_bad)
+		return StatsCollector.Statistics(*StatsCollector._measurement_struct.unpack_from(data))
@@ -0,0 +1,139 @@
+"""
+	zbnt/python-client
+	Copyright (C) 2022 Oscar R.
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import queue
+import socket
+import threading
+
+class ThreadedTransport:
+	RECV_SIZE = 262144
+
+	def __init__(self, loop, sock, protocol):
+		self.loop = loop
+		self.sock = sock
+		self.protocol = protocol
+		self.closing = False
+		self.write_error = None
+		self.reading = threading.Event()
+		self.write_queue = queue.SimpleQueue()
+		self.thread = threading.Thread(target=self.__read_loop, name="zbnt-reader", daemon=True)
+		self.writer = threading.Thread(target=self.__write_loop, name="zbnt-writer", daemon=True)
+
+		self.sock.setblocking(True)
+		self.reading.set()
+
+	def __repr__(self):
+		return f"ThreadedTransport(socket={self.sock})"
+
+	def start(self):
+		self.protocol.connection_made(self)
+		self.writer.start()
+		self.thread.start()
+
+	def get_extra_info(self, name, default=None):
+		if name == "socket":
+			return self.sock
+
+		return default
+
+	def is_closing(self):
+		return self.closing
+
+	def pause_reading(self):
+		self.reading.clear()
+
+	def resume_reading(self):
+		self.reading.set()
+
+	def write(self, data):
+		# Data is sent by the writer thread, so the event loop is never blocked by a slow server
+		if self.closing:
+			return
+
+		self.write_queue.put(data)
+
+	def writelines(self, list_of_data):
+		self.write(b"".join(list_of_data))
+
+	def close(self):
+		if self.closing:
+			return
+
+		self.closing = True
+		self.reading.set()
+
+		# The writer thread sends the data still in the queue before shutting down the socket
+		self.write_queue.put(None)
+
+	def __shutdown(self):
+		try:
+			# Wakes up the reader and writer threads, the socket is closed once both exit
+			self.sock.shutdown(socket.SHUT_RDWR)
+		except OSError:
+			pass
+
+	def __write_loop(self):
+		try:
+			while True:
+				data = self.write_queue.get()
+
+				if data == None:
+					break
+
+				self.sock.sendall(data)
+		except OSError as e:
+			if not self.closing:
+				self.write_error = e
+		finally:
+			self.closing = True
+			self.__shutdown()
+
+	def __read_loop(self):
+		exc = None
+
+		try:
+			while not self.closing:
+				self.reading.wait()
+
+				data = self.sock.recv(ThreadedTransport.RECV_SIZE)
+
+				if len(data) == 0:
+					break
+
+				self.protocol.thread_data_received(data)
+		except OSError as e:
+			if not self.closing:
+				exc = e
+		finally:
+			if not self.closing:
+				# Connection lost, data waiting to be sent is discarded
+				self.closing = True
+				self.__shutdown()
+
+			self.write_queue.put(None)
+			self.writer.join()
+			self.sock.close()
+
+			if exc == None:
+				exc = self.write_error
+
+			try:
+				self.loop.call_soon_threadsafe(self.protocol.connection_lost, exc)
+			except RuntimeError:
+				# Event loop has already been closed
+				pass
@@ -16,8 +16,17 @@
 	along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
-import asyncio
+import time
 import socket
+import asyncio
+import inspect
+
+from collections import deque
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
 
 from .AxiDevice import *
 from .AxiMdio import *
@@ -29,8 +38,29 @@ from .TrafficGenerator import *
 
 from .Encoding import *
 from .MessageReceiver import *
+from .MeasurementQueue import *
+from .ThreadedTransport import *
 
 class ZbntClient(MessageReceiver):
+	_property_header_struct = get_struct("BH")
+	_device_header_struct = get_struct("BBH")
+	_device_property_struct = get_struct("HH")
+
+	# Parsed device tables, indexed by bitstream name: (table_bytes, device_table)
+	_device_table_cache = dict()
+
+	# Whether parsing stops as soon as reading is paused, leaving the remaining messages in the buffer
+	_pause_parsing = True
+
+	device_classes = {
+		Devices.DEV_AXI_MDIO: AxiMdio,
+		Devices.DEV_SIMPLE_TIMER: SimpleTimer,
+		Devices.DEV_FRAME_DETECTOR: FrameDetector,
+		Devices.DEV_STATS_COLLECTOR: StatsCollector,
+		Devices.DEV_LATENCY_MEASURER: LatencyMeasurer,
+		Devices.DEV_TRAFFIC_GENERATOR: TrafficGenerator
+	}
+
 	def __init__(self):
 		super().__init__()
 
@@ -41,78 +71,311 @@ class ZbntClient(MessageReceiver):
 		self.received_hello = False
 		self.connected = False
 		self.disconnecting = False
+		self.endpoint = None
+		self.reconnect_delay = None
+		self.reconnect_max_delay = None
+		self.reconnect_timeout = None
+		self.reconnecting = False
+		self.restoring = False
+		self.running = False
+		self.active_bitstream = ""
+		self.device_table_valid = False
+		self.property_log = dict()
 		self.devices = dict()
+		self.device_table = []
 		self.callback = None
-		self.pending_msg = None
+		self.batch_callback = None
+		self.batch_max_size = None
+		self.batch_max_delay = None
+		self.batch_timer = None
+		self.batch = []
+		self.columnar_callback = None
+		self.columnar_max_size = None
+		self.columnar_max_delay = None
+		self.columnar_timer = None
+		self.columnar_buffers = dict()
+		self.measurement_queue = None
+		self.measurement_consumer = None
+		self.read_pausers = set()
+		self.subscriptions = []
+		self.measurement_routes = dict()
+		self.message_handlers = {
+			Messages.MSG_ID_HELLO: self.hello_received,
+			Messages.MSG_ID_PROGRAM_PL: self.program_pl_received,
+			Messages.MSG_ID_RUN_START: self.run_start_received,
+			Messages.MSG_ID_RUN_STOP: self.run_stop_received,
+			Messages.MSG_ID_SET_PROPERTY: self.property_received,
+			Messages.MSG_ID_GET_PROPERTY: self.property_received
+		}
+		self.pending_requests = dict()
+		self.tx_queue = []
 
 	@staticmethod
-	async def connect(device, timeout=5):
+	async def connect(device, timeout=5, buffered=False, threaded=False, reconnect=False):
 		if not device["local"]:
-			return await ZbntClient.connectTcp(device["address"], device["port"], timeout)
+			return await ZbntClient.connectTcp(device["address"], device["port"], timeout, buffered, threaded, reconnect)
 		else:
-			return await ZbntClient.connectLocal(device["pid"], timeout)
+			return await ZbntClient.connectLocal(device["pid"], timeout, buffered, threaded, reconnect)
 
 	@staticmethod
-	async def connectTcp(addr, port, timeout=5):
-		loop = asyncio.get_running_loop()
+	async def connectTcp(addr, port, timeout=5, buffered=False, threaded=False, reconnect=False):
+		client = ZbntClient.create_client(buffered, threaded)
+		client.endpoint = (addr, port)
 
-		_, client = await loop.create_connection(
-			lambda: ZbntClient(),
-			addr,
-			port
-		)
+		return await ZbntClient.open_client(client, timeout, reconnect)
 
-		try:
-			if not await asyncio.wait_for(client.on_connected, timeout=timeout):
-				return None
-		except asyncio.TimeoutError:
-			return None
+	@staticmethod
+	async def connectLocal(pid, timeout=5, buffered=False, threaded=False, reconnect=False):
+		client = ZbntClient.create_client(buffered, threaded)
+		client.endpoint = pid
 
-		return client
+		return await ZbntClient.open_client(client, timeout, reconnect)
 
 	@staticmethod
-	async def connectLocal(pid, timeout=5):
-		loop = asyncio.get_running_loop()
+	async def connectThreaded(sock, timeout=5):
+		client = ThreadedZbntClient()
+		ThreadedTransport(asyncio.get_running_loop(), sock, client).start()
+
+		return await ZbntClient.wait_for_hello(client, timeout)
 
+	@staticmethod
+	def create_client(buffered, threaded):
+		if threaded:
+			return ThreadedZbntClient()
+
+		if buffered:
+			return BufferedZbntClient()
+
+		return ZbntClient()
+
+	@staticmethod
+	async def open_client(client, timeout, reconnect):
+		await client.open_connection()
+		client = await ZbntClient.wait_for_hello(client, timeout)
+
+		if client != None and reconnect:
+			client.enable_reconnect(timeout=timeout)
+
+		return client
+
+	@staticmethod
+	def open_local_socket(pid):
 		sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM, 0)
-		sock.connect("\0/tmp/zbnt-local-{:016X}".format(pid).encode())
 
-		_, client = await loop.create_connection(
-			lambda: ZbntClient(),
-			sock=sock
-		)
+		try:
+			sock.connect("\0/tmp/zbnt-local-{:016X}".format(pid).encode())
+		except OSError:
+			sock.close()
+			raise
 
+		return sock
+
+	async def open_connection(self):
+		# Opens a new connection to self.endpoint, using this object as the protocol
+		loop = asyncio.get_running_loop()
+
+		if isinstance(self.endpoint, tuple):
+			await loop.create_connection(lambda: self, *self.endpoint)
+		else:
+			await loop.create_connection(lambda: self, sock=ZbntClient.open_local_socket(self.endpoint))
+
+	@staticmethod
+	async def wait_for_hello(client, timeout, disconnect=True):
+		# Clients that fail the handshake are disconnected, unless disconnect is False
 		try:
-			if not await asyncio.wait_for(client.on_connected, timeout=timeout):
-				return None
+			connected = await asyncio.wait_for(client.on_connected, timeout=timeout)
 		except asyncio.TimeoutError:
+			connected = False
+
+		if not connected:
+			if disconnect:
+				client.disconnect()
+
 			return None
 
 		return client
 
+	def enable_reconnect(self, initial_delay=0.5, max_delay=30, timeout=5):
+		# If the connection is lost, the client tries to reconnect with exponential backoff instead of exiting.
+		# Once connected, the active bitstream is loaded again, every property set through this client is
+		# written again in the same order and the run is restarted if it was active. Streams and subscribers
+		# created with gaps=True receive a MeasurementGap for every device that produces measurements once the
+		# session has been restored.
+		if self.endpoint == None:
+			raise ValueError("Server address is unknown, client must be created with connect()")
+
+		self.reconnect_delay = initial_delay
+		self.reconnect_max_delay = max_delay
+		self.reconnect_timeout = timeout
+
+	def disable_reconnect(self):
+		self.reconnect_delay = None
+
 	def disconnect(self):
 		self.disconnecting = True
+		self.disable_flow_control()
+		self.flush_batch()
+		self.flush_columnar()
+		self.flush_messages()
 		self.transport.close()
 
 	def set_callback(self, callback):
 		self.callback = callback
+		self.update_routes()
+
+	def set_batch_callback(self, callback, max_batch=None, max_delay=None):
+		# Measurements are passed to callback as a list of (device, measurement) tuples, once per received
+		# chunk of data or, if max_delay is set, once max_delay seconds have passed since the first one arrived
+		self.flush_batch()
+
+		self.batch_callback = callback
+		self.batch_max_size = max_batch
+		self.batch_max_delay = max_delay
+		self.update_routes()
+
+	def flush_batch(self):
+		if self.batch_timer != None:
+			self.batch_timer.cancel()
+			self.batch_timer = None
+
+		if len(self.batch) == 0:
+			return
+
+		batch = self.batch
+		self.batch = []
+
+		if self.batch_callback != None:
+			self.batch_callback(batch)
+
+	def set_columnar_callback(self, callback, max_records=None, max_delay=None):
+		# Measurements from devices with a fixed record layout are collected as raw bytes and passed to
+		# callback(device, array) as NumPy structured arrays, flushed like in set_batch_callback
+		if numpy == None:
+			raise ImportError("NumPy is required for columnar decoding, install zbnt-client[numpy]")
+
+		self.flush_columnar()
+
+		self.columnar_callback = callback
+		self.columnar_max_size = max_records
+		self.columnar_max_delay = max_delay
+		self.update_routes()
+
+	def flush_columnar(self):
+		if self.columnar_timer != None:
+			self.columnar_timer.cancel()
+			self.columnar_timer = None
+
+		if len(self.columnar_buffers) == 0:
+			return
+
+		buffers = self.columnar_buffers
+		self.columnar_buffers = dict()
+
+		if self.columnar_callback == None:
+			return
+
+		for dev_id, data in buffers.items():
+			dev_obj = self.devices.get(dev_id, None)
+
+			if dev_obj != None:
+				self.columnar_callback(dev_obj, numpy.frombuffer(data, dtype=dev_obj._measurement_dtype))
+
+	def set_flow_control(self, maxsize, low_watermark=None, policy=DropPolicy.BLOCK, max_batch=None):
+		# Measurements are passed to the callbacks from a separate task through a bounded queue, if the queue
+		# fills up measurements are dropped or, with DropPolicy.BLOCK, reading from the socket is paused until
+		# the queue size goes down to low_watermark. Callbacks can be coroutines in this mode.
+		self.disable_flow_control()
+
+		self.measurement_queue = MeasurementQueue(self, maxsize, low_watermark, policy)
+		self.measurement_consumer = asyncio.get_running_loop().create_task(
+			self.consume_measurements(self.measurement_queue, max_batch)
+		)
+
+		self.update_routes()
+
+	def disable_flow_control(self):
+		if self.measurement_consumer != None:
+			self.measurement_consumer.cancel()
+			self.measurement_consumer = None
+
+		if self.measurement_queue != None:
+			self.measurement_queue.close()
+			self.measurement_queue = None
+			self.update_routes()
+
+	async def consume_measurements(self, queue, max_batch):
+		while True:
+			batch = await queue.get(max_batch)
+
+			try:
+				for dev_obj, meas_obj in batch:
+					res = self.deliver_measurement(dev_obj, meas_obj)
+
+					if inspect.isawaitable(res):
+						await res
+
+				self.schedule_batch_flush()
+			finally:
+				queue.task_done(len(batch))
+
+			# Let other tasks run between batches
+			await asyncio.sleep(0)
+
+	def pause_reading(self, source):
+		# The message being processed is the last one parsed until reading is resumed, the rest of the received
+		# data is kept in the buffer
+		if len(self.read_pausers) == 0 and not self.transport.is_closing():
+			self.transport.pause_reading()
+
+		self.read_pausers.add(source)
+		self.parsing_paused = self._pause_parsing
+
+	def resume_reading(self, source):
+		if source not in self.read_pausers:
+			return
+
+		self.read_pausers.remove(source)
+
+		if len(self.read_pausers) != 0:
+			return
+
+		if self.parsing_paused:
+			self.parsing_paused = False
+			asyncio.get_running_loop().call_soon(self.parse_pending)
+
+		if not self.transport.is_closing():
+			self.transport.resume_reading()
 
 	def send_message(self, msg_id, payload):
-		self.transport.write(MessageReceiver.MSG_MAGIC_IDENTIFIER)
-		self.transport.write(encode_u16(msg_id))
-		self.transport.write(encode_u16(len(payload)))
-		self.transport.write(payload)
+		# Messages sent during the same loop iteration are written to the socket at once
+		if len(self.tx_queue) == 0:
+			asyncio.get_running_loop().call_soon(self.flush_messages)
+
+		self.tx_queue.append(MessageReceiver.encode_message_header(msg_id, len(payload)))
+
+		if len(payload):
+			self.tx_queue.append(payload)
+
+	def flush_messages(self):
+		if len(self.tx_queue) == 0:
+			return
+
+		tx_queue = self.tx_queue
+		self.tx_queue = []
+
+		if not self.transport.is_closing():
+			self.transport.writelines(tx_queue)
 
 	async def start_run(self):
 		if not self.connected:
 			raise Exception("Not connected to server")
 
-		self.pending_msg = Messages.MSG_ID_RUN_START
-		self.pending_msg_future = asyncio.get_running_loop().create_future()
+		future = self.create_request( (Messages.MSG_ID_RUN_START, None, None) )
 
 		self.send_message(Messages.MSG_ID_RUN_START, b"")
-		await self.pending_msg_future
+		await future
 
+		self.running = True
 		self.on_run_end = asyncio.get_running_loop().create_future()
 
 	async def stop_run(self):
@@ -125,45 +388,289 @@ class ZbntClient(MessageReceiver):
 	async def wait_for_run_end(self):
 		await self.on_run_end
 
-	async def load_bitstream(self, name):
+	async def load_bitstream(self, name, reload=True):
+		# If reload is False and the bitstream is already active, the PL isn't programmed again and the current
+		# devices are kept
 		if not self.connected:
 			raise Exception("Not connected to server")
 
-		self.pending_msg = Messages.MSG_ID_PROGRAM_PL
-		self.pending_msg_future = asyncio.get_running_loop().create_future()
+		if not reload and self.device_table_valid and self.active_bitstream == name:
+			return True
+
+		future = self.create_request( (Messages.MSG_ID_PROGRAM_PL, None, None) )
 
 		self.send_message(Messages.MSG_ID_PROGRAM_PL, encode_u16(len(name)) + encode_str(name))
-		return await self.pending_msg_future
+		return await future
 
 	async def set_raw_property(self, dev_id, prop_id, value):
 		if not self.connected:
 			raise Exception("Not connected to server")
 
-		self.pending_msg = Messages.MSG_ID_SET_PROPERTY
-		self.pending_msg_params = (dev_id, prop_id)
-		self.pending_msg_future = asyncio.get_running_loop().create_future()
+		future = self.create_request( (Messages.MSG_ID_SET_PROPERTY, dev_id, prop_id) )
 
-		payload = encode_u8(dev_id)
-		payload += encode_u16(prop_id)
-		payload += value
+		payload = ZbntClient._property_header_struct.pack(dev_id, prop_id) + value
 
 		self.send_message(Messages.MSG_ID_SET_PROPERTY, payload)
-		return await self.pending_msg_future
+		success = await future
+
+		self.record_property(dev_id, prop_id, value, success)
+		return success
 
 	async def get_raw_property(self, dev_id, prop_id, params=b""):
 		if not self.connected:
 			raise Exception("Not connected to server")
 
-		self.pending_msg = Messages.MSG_ID_GET_PROPERTY
-		self.pending_msg_params = (dev_id, prop_id)
-		self.pending_msg_future = asyncio.get_running_loop().create_future()
+		future = self.create_request( (Messages.MSG_ID_GET_PROPERTY, dev_id, prop_id) )
 
-		payload = encode_u8(dev_id)
-		payload += encode_u16(prop_id)
-		payload += params
+		payload = ZbntClient._property_header_struct.pack(dev_id, prop_id) + params
 
 		self.send_message(Messages.MSG_ID_GET_PROPERTY, payload)
-		return await self.pending_msg_future
+		return await future
+
+	async def configure(self, config, force=False):
+		# config: {device: {prop_id: value, (value, params) or a list of them}}
+		# All properties are encoded before sending anything and sent in a single write, returns a
+		# dictionary with the same structure containing the result of every request
+		# Values that are already set are skipped like in set_property, unless force is True
+		if not self.connected:
+			raise Exception("Not connected to server")
+
+		requests = []
+
+		for device, properties in config.items():
+			for prop_id, settings in properties.items():
+				for setting in (settings if isinstance(settings, list) else [settings]):
+					if isinstance(setting, tuple):
+						value, params = setting
+					else:
+						value, params = setting, dict()
+
+					requests.append( (device, prop_id, device.encode_property(prop_id, value, params)) )
+
+		futures = []
+
+		for device, prop_id, value in requests:
+			if not force and device.is_property_cached(prop_id, value):
+				future = asyncio.get_running_loop().create_future()
+				future.set_result(True)
+			else:
+				future = self.create_request( (Messages.MSG_ID_SET_PROPERTY, device.id, prop_id) )
+				self.send_message(Messages.MSG_ID_SET_PROPERTY, ZbntClient._property_header_struct.pack(device.id, prop_id) + value)
+
+			futures.append(future)
+
+		results = await asyncio.gather(*futures)
+
+		for (device, prop_id, value), success in zip(requests, results):
+			self.record_property(device.id, prop_id, value, success)
+
+		results = iter(results)
+		res = dict()
+
+		for device, properties in config.items():
+			res[device] = dict()
+
+			for prop_id, settings in properties.items():
+				if isinstance(settings, list):
+					res[device][prop_id] = [next(results) for _ in settings]
+				else:
+					res[device][prop_id] = next(results)
+
+		return res
+
+	async def get_properties(self, queries, use_cache=True):
+		# queries: list of (device, prop_id) or (device, prop_id, params) tuples
+		# All queries are validated before sending anything and sent in a single write, returns a list of
+		# (success, value) tuples in the same order, values are decoded like in get_property
+		if not self.connected:
+			raise Exception("Not connected to server")
+
+		requests = []
+
+		for query in queries:
+			device, prop_id = query[0], query[1]
+			params = query[2] if len(query) > 2 else dict()
+
+			requests.append( (device, prop_id) + device.encode_property_query(prop_id, params) )
+
+		futures = []
+
+		for device, prop_id, _, param_bytes in requests:
+			value = device.property_cache.get( (prop_id, param_bytes), None ) if use_cache else None
+
+			if value != None:
+				future = asyncio.get_running_loop().create_future()
+				future.set_result( (True, value) )
+			else:
+				future = self.create_request( (Messages.MSG_ID_GET_PROPERTY, device.id, prop_id) )
+				self.send_message(Messages.MSG_ID_GET_PROPERTY, ZbntClient._property_header_struct.pack(device.id, prop_id) + param_bytes)
+
+			futures.append(future)
+
+		res = []
+
+		for (device, prop_id, decoder, _), (success, value) in zip(requests, await asyncio.gather(*futures)):
+			try:
+				decoded_value = decoder(value) if success else None
+			except Exception:
+				# A malformed reply only fails its own query
+				decoded_value = None
+
+			if decoded_value == None:
+				res.append( (False, None) )
+				continue
+
+			device.cache_property(prop_id, value)
+			res.append( (True, decoded_value) )
+
+		return res
+
+	def create_request(self, key):
+		# Requests are identified by (msg_id, dev_id, prop_id), the server answers requests in the order they
+		# were sent, so requests with the same key are resolved in FIFO order
+		future = asyncio.get_running_loop().create_future()
+		queue = self.pending_requests.get(key, None)
+
+		if queue == None:
+			queue = deque()
+			self.pending_requests[key] = queue
+
+		queue.append(future)
+		return future
+
+	def resolve_request(self, key, result):
+		queue = self.pending_requests.get(key, None)
+
+		if queue == None:
+			return
+
+		future = queue.popleft()
+
+		if len(queue) == 0:
+			del self.pending_requests[key]
+
+		if not future.done():
+			future.set_result(result)
+
+	def fail_requests(self, message):
+		pending = self.pending_requests
+		self.pending_requests = dict()
+
+		for queue in pending.values():
+			for future in queue:
+				if not future.done():
+					future.set_exception(ConnectionError(message))
+
+	def record_property(self, dev_id, prop_id, value, success):
+		# Properties are replayed in the order they were last set after reconnecting, values with different
+		# parameters (e.g. port or index) are kept as separate entries
+		dev_obj = self.devices.get(dev_id, None)
+		params_size = 0
+
+		if dev_obj != None:
+			params_size, _ = dev_obj._property_params.get(prop_id, (0, []))
+			dev_obj.cache_property(prop_id, value, success)
+
+		if not success:
+			return
+
+		key = (dev_id, prop_id, bytes(value[:params_size]))
+
+		self.property_log.pop(key, None)
+		self.property_log[key] = value
+
+	async def reconnect(self):
+		lost_time = time.time()
+		bitstream = self.active_bitstream
+		delay = self.reconnect_delay
+		loop = asyncio.get_running_loop()
+
+		try:
+			while not self.disconnecting and self.reconnect_delay != None:
+				await asyncio.sleep(delay)
+				delay = min(delay * 2, self.reconnect_max_delay)
+
+				self.received_hello = False
+				self.on_connected = loop.create_future()
+				self.tx_queue = []
+				self.reset_receiver()
+
+				try:
+					await self.open_connection()
+
+					if await ZbntClient.wait_for_hello(self, self.reconnect_timeout, False) == None:
+						raise ConnectionError("Server did not answer to HELLO")
+
+					await self.restore_session(bitstream, lost_time)
+					return
+				except OSError:
+					if self.connected:
+						self.transport.close()
+		finally:
+			self.reconnecting = False
+
+	def check_connection(self):
+		# Requests created while disconnected would never be resolved
+		if not self.connected:
+			raise ConnectionError("Connection to server lost")
+
+	async def restore_session(self, bitstream, lost_time):
+		running = self.running
+
+		if bitstream != "":
+			self.check_connection()
+			self.restoring = True
+
+			try:
+				if not await self.load_bitstream(bitstream):
+					raise ConnectionError("Failed to load bitstream " + bitstream)
+			finally:
+				self.restoring = False
+
+		self.check_connection()
+
+		futures = []
+		replayed = list(self.property_log.items())
+
+		for (dev_id, prop_id, _), value in replayed:
+			futures.append(self.create_request( (Messages.MSG_ID_SET_PROPERTY, dev_id, prop_id) ))
+			self.send_message(Messages.MSG_ID_SET_PROPERTY, ZbntClient._property_header_struct.pack(dev_id, prop_id) + value)
+
+		for ((dev_id, prop_id, _), value), success in zip(replayed, await asyncio.gather(*futures)):
+			self.record_property(dev_id, prop_id, value, success)
+
+		self.notify_gap(MeasurementGap(lost_time, time.time(), running))
+
+		if running:
+			self.check_connection()
+
+			future = self.create_request( (Messages.MSG_ID_RUN_START, None, None) )
+
+			self.send_message(Messages.MSG_ID_RUN_START, b"")
+			await future
+
+	def notify_gap(self, gap):
+		loop = asyncio.get_running_loop()
+
+		for dev_obj in self.devices.values():
+			if dev_obj._measurement_schema == None:
+				continue
+
+			subscribers = [stream.queue.put for stream in dev_obj.streams if stream.gaps]
+
+			for callback, device, device_type, _, raw, gaps in self.subscriptions:
+				if gaps and not raw and (device == None or device is dev_obj) and (device_type == None or device_type == dev_obj.device_type):
+					subscribers.append(callback)
+
+			for subscriber in subscribers:
+				try:
+					subscriber(dev_obj, gap)
+				except Exception as e:
+					# A failing consumer must not prevent the session from being restored
+					loop.call_exception_handler({
+						"message": "Exception in measurement gap handler",
+						"exception": e
+					})
 
 	def get_device(self, dev_type, ports=set()):
 		for d in self.devices.values():
@@ -176,145 +683,378 @@ class ZbntClient(MessageReceiver):
 		super().connection_made(transport)
 		self.connected = True
 
+		if len(self.read_pausers):
+			transport.pause_reading()
+
 		# Connection must start with a HELLO message to the server, or connection will be dropped
 		self.send_message(Messages.MSG_ID_HELLO, b"")
 
 	def connection_lost(self, exc):
 		self.connected = False
 
-		if not self.received_hello:
+		if not self.on_connected.done():
 			self.on_connected.set_result(False)
 
-		if not self.disconnecting:
+		self.fail_requests("Connection to server lost")
+
+		# Connections lost during the handshake are handled by wait_for_hello
+		if self.disconnecting or self.reconnecting or not self.received_hello:
+			return
+
+		if self.reconnect_delay == None:
 			exit(1)
 
+		self.reconnecting = True
+		asyncio.get_running_loop().create_task(self.reconnect())
+
 	def data_received(self, data):
 		super().bytes_received(data)
+		self.chunk_processed()
+
+	def buffer_updated(self, nbytes):
+		super().buffer_updated(nbytes)
+		self.chunk_processed()
+
+	def parse_pending(self):
+		super().parse_pending()
+		self.chunk_processed()
+
+	def chunk_processed(self):
+		if self.measurement_queue == None:
+			self.schedule_batch_flush()
+
+		if len(self.columnar_buffers) != 0:
+			if self.columnar_max_delay == None:
+				self.flush_columnar()
+			elif self.columnar_timer == None:
+				self.columnar_timer = asyncio.get_running_loop().call_later(self.columnar_max_delay, self.flush_columnar)
+
+	def schedule_batch_flush(self):
+		if len(self.batch) == 0:
+			return
+
+		if self.batch_max_delay == None:
+			self.flush_batch()
+		elif self.batch_timer == None:
+			self.batch_timer = asyncio.get_running_loop().call_later(self.batch_max_delay, self.flush_batch)
+
+	def deliver_measurement(self, dev_obj, meas_obj):
+		res = None
+
+		if self.callback != None:
+			res = self.callback(dev_obj, meas_obj)
+
+		if self.batch_callback != None:
+			self.batch.append( (dev_obj, meas_obj) )
+
+			if self.batch_max_size != None and len(self.batch) >= self.batch_max_size:
+				self.flush_batch()
+
+		return res
+
+	async def finish_run(self):
+		if self.measurement_queue != None:
+			await self.measurement_queue.join()
+
+		self.flush_batch()
+		self.flush_columnar()
+		self.on_run_end.set_result(None)
 
 	def create_device(self, dev_id, dev_type, initial_props):
-		if dev_type == Devices.DEV_AXI_MDIO:
-			return AxiMdio(self, dev_id, initial_props)
+		return ZbntClient.device_classes.get(dev_type, AxiDevice)(self, dev_id, initial_props)
+
+	def device_subscribers(self, dev_obj):
+		# Returns two lists of (subscriber, threadsafe) tuples, for decoded and raw measurements of a device
+		subscribers = [(stream.queue.put, False) for stream in dev_obj.streams]
+		raw_subscribers = []
+
+		if self.callback != None or self.batch_callback != None:
+			if self.measurement_queue != None:
+				subscribers.append( (self.measurement_queue.put, False) )
+			else:
+				subscribers.append( (self.deliver_measurement, False) )
+
+		if self.columnar_callback != None and dev_obj._measurement_dtype != None:
+			raw_subscribers.append( (self.collect_columnar, False) )
+
+		for callback, device, device_type, threadsafe, raw, _ in self.subscriptions:
+			if (device == None or device is dev_obj) and (device_type == None or device_type == dev_obj.device_type):
+				if raw:
+					raw_subscribers.append( (callback, threadsafe) )
+				else:
+					subscribers.append( (callback, threadsafe) )
+
+		return (subscribers, raw_subscribers)
+
+	def update_routes(self):
+		# Precomputes (device, decoder, subscribers, raw_subscribers) for every device that has at least one
+		# consumer of its measurements, must be called whenever devices or subscriptions change
+		routes = dict()
+
+		for dev_id, dev_obj in self.devices.items():
+			subscribers, raw_subscribers = self.device_subscribers(dev_obj)
 
-		if dev_type == Devices.DEV_SIMPLE_TIMER:
-			return SimpleTimer(self, dev_id, initial_props)
+			if len(subscribers) or len(raw_subscribers):
+				routes[Messages.MSG_ID_MEASUREMENT | dev_id] = (
+					dev_obj,
+					dev_obj.receive_measurement,
+					[self.wrap_subscriber(*s) for s in subscribers],
+					[self.wrap_subscriber(*s) for s in raw_subscribers]
+				)
 
-		if dev_type == Devices.DEV_FRAME_DETECTOR:
-			return FrameDetector(self, dev_id, initial_props)
+		self.measurement_routes = routes
 
-		if dev_type == Devices.DEV_STATS_COLLECTOR:
-			return StatsCollector(self, dev_id, initial_props)
+	def subscribe(self, callback, device=None, device_type=None, threadsafe=False, raw=False, gaps=False):
+		# callback(device, measurement) will be called for every measurement received from the given device,
+		# from devices of the given type, or from every device if neither is specified
+		# In threaded mode, callbacks marked as threadsafe are called directly from the reader thread
+		# Raw subscribers receive the undecoded payload, which might be a view of the receive buffer
+		# If gaps is True, a MeasurementGap is passed instead of a measurement after reconnecting
+		self.subscriptions.append( (callback, device, device_type, threadsafe, raw, gaps) )
+		self.update_routes()
 
-		if dev_type == Devices.DEV_LATENCY_MEASURER:
-			return LatencyMeasurer(self, dev_id, initial_props)
+	def unsubscribe(self, callback):
+		self.subscriptions = [s for s in self.subscriptions if s[0] != callback]
+		self.update_routes()
 
-		if dev_type == Devices.DEV_TRAFFIC_GENERATOR:
-			return TrafficGenerator(self, dev_id, initial_props)
+	def wrap_subscriber(self, subscriber, threadsafe):
+		return subscriber
 
-		return AxiDevice(self, dev_id, initial_props)
+	def collect_columnar(self, dev_obj, msg_payload):
+		record_size = dev_obj._measurement_struct.size
+
+		if len(msg_payload) < record_size:
+			return
+
+		data = self.columnar_buffers.get(dev_obj.id, None)
+
+		if data == None:
+			data = bytearray()
+			self.columnar_buffers[dev_obj.id] = data
+
+		data += msg_payload[:record_size]
+
+		if self.columnar_max_size != None and len(data) >= self.columnar_max_size * record_size:
+			self.flush_columnar()
 
 	def message_received(self, msg_id, msg_payload):
+		route = self.measurement_routes.get(msg_id, None)
+
+		if route != None:
+			dev_obj, decoder, subscribers, raw_subscribers = route
+
+			if len(msg_payload) < 8:
+				return
+
+			for raw_subscriber in raw_subscribers:
+				raw_subscriber(dev_obj, msg_payload)
+
+			if len(subscribers):
+				meas_obj = decoder(msg_payload)
+
+				if meas_obj != None:
+					for subscriber in subscribers:
+						subscriber(dev_obj, meas_obj)
+
+			return
+
+		self.control_received(msg_id, msg_payload)
+
+	def control_received(self, msg_id, msg_payload):
+		handler = self.message_handlers.get(msg_id, None)
+
+		if handler == None:
+			return
+
 		# Server should not send other kind of messages without responding to HELLO first
 		if not (self.received_hello ^ (msg_id == Messages.MSG_ID_HELLO)):
 			return
 
-		if msg_id == Messages.MSG_ID_HELLO:
-			# HELLO response includes list of available bitstreams
-			i = 0
+		# Payload might be a view of the receive buffer, control messages need their own copy
+		handler(msg_id, bytes(msg_payload))
 
-			if len(msg_payload) < 2:
-				return
+	def hello_received(self, msg_id, msg_payload):
+		# HELLO response includes list of available bitstreams
+		i = 0
+
+		if len(msg_payload) < 2:
+			return
 
-			self.bitstreams = []
-			self.received_hello = True
-			self.active_bitstream = ""
-			self.on_connected.set_result(True)
+		self.bitstreams = []
+		self.received_hello = True
+		self.active_bitstream = ""
+		self.device_table_valid = False
+		self.on_connected.set_result(True)
 
-			while i < len(msg_payload) - 2:
-				name_size = decode_u16(msg_payload[i:i+2])
-				name = msg_payload[i+2:i+2+name_size].decode("UTF-8")
+		while i < len(msg_payload) - 2:
+			name_size = decode_u16(msg_payload, i)
+			name = msg_payload[i+2:i+2+name_size].decode("UTF-8")
 
-				if len(name):
-					self.bitstreams.append(name)
+			if len(name):
+				self.bitstreams.append(name)
 
-				i += name_size + 2
-		elif msg_id == Messages.MSG_ID_PROGRAM_PL:
-			if len(msg_payload) < 3:
-				return
+			i += name_size + 2
 
-			success = msg_payload[0]
-			name_len = decode_u16(msg_payload[1:3])
+	def program_pl_received(self, msg_id, msg_payload):
+		if len(msg_payload) < 3:
+			return
+
+		success = msg_payload[0]
+		name_len = decode_u16(msg_payload, 1)
 
-			self.active_bitstream = msg_payload[3:3+name_len].decode("UTF-8")
-			self.devices = dict()
+		if self.restoring and not success:
+			# Devices, streams and subscriptions are kept until the PL is programmed again successfully
+			self.resolve_request( (msg_id, None, None), success )
+			return
 
-			i = 3 + name_len
-			while i + 3 < len(msg_payload):
-				dev_id = msg_payload[i]
-				dev_type = msg_payload[i+1]
+		self.active_bitstream = msg_payload[3:3+name_len].decode("UTF-8")
+		self.device_table_valid = bool(success)
 
-				try:
-					dev_type = Devices(dev_type)
-				except ValueError:
-					pass
-
-				j = 0
-				props_list = []
-				props_size = decode_u16(msg_payload[i+2:i+4])
-				props_bytes = msg_payload[i+4:i+4+props_size]
-
-				while j + 3 < len(props_bytes):
-					prop_id = decode_u16(props_bytes[j:j+2])
-					prop_size = decode_u16(props_bytes[j+2:j+4])
-					prop_value = props_bytes[j+4:j+4+prop_size]
-
-					try:
-						prop_id = Properties(prop_id)
-					except ValueError:
-						pass
-
-					props_list.append( (prop_id, prop_value) )
-					j += 4 + prop_size
-
-				self.devices[dev_id] = self.create_device(dev_id, dev_type, props_list)
-				i += 4 + props_size
-
-			if self.pending_msg == msg_id:
-				self.pending_msg_future.set_result(success)
-				self.pending_msg = None
-				self.pending_msg_params = None
-				self.pending_msg_future = None
-		elif msg_id == Messages.MSG_ID_RUN_START:
-			if self.pending_msg == msg_id:
-				self.pending_msg_future.set_result(True)
-				self.pending_msg = None
-				self.pending_msg_params = None
-				self.pending_msg_future = None
-		elif msg_id == Messages.MSG_ID_RUN_STOP:
+		# Parsing is skipped if the table is the same one received last time this bitstream was loaded
+		table_bytes = msg_payload[3+name_len:]
+		cached = ZbntClient._device_table_cache.get(self.active_bitstream, None)
+
+		if cached != None and cached[0] == table_bytes:
+			device_table = cached[1]
+		else:
+			device_table = ZbntClient.parse_device_table(table_bytes)
+
+			if success:
+				ZbntClient._device_table_cache[self.active_bitstream] = (table_bytes, device_table)
+
+		# When restoring a session, device objects are kept so that streams and subscriptions stay valid
+		old_devices = self.devices
+		reused_devices = old_devices if self.restoring else dict()
+
+		if not self.restoring:
+			self.property_log = dict()
+
+		self.devices = dict()
+		self.device_table = device_table
+
+		for dev_id, dev_type, props_list in device_table:
+			dev_obj = reused_devices.get(dev_id, None)
+
+			if dev_obj == None or dev_obj.device_type != dev_type:
+				dev_obj = self.create_device(dev_id, dev_type, props_list)
+
+			self.devices[dev_id] = dev_obj
+
+			if self.restoring:
+				# The PL has been programmed again, the cache is filled again with the replayed values
+				dev_obj.clear_property_cache()
+
+		for dev_obj in old_devices.values():
+			if self.devices.get(dev_obj.id, None) is not dev_obj:
+				for stream in list(dev_obj.streams):
+					stream.close()
+
+		# Subscriptions to devices that no longer exist are removed
+		self.subscriptions = [s for s in self.subscriptions if s[1] == None or self.devices.get(s[1].id, None) is s[1]]
+		self.update_routes()
+
+		self.resolve_request( (msg_id, None, None), success )
+
+	@staticmethod
+	def parse_device_table(table_bytes):
+		# Returns a list of (dev_id, dev_type, [(prop_id, prop_value), ...]) tuples
+		device_table = []
+
+		i = 0
+		while i + 3 < len(table_bytes):
+			dev_id, dev_type, props_size = ZbntClient._device_header_struct.unpack_from(table_bytes, i)
+			dev_type = devices_by_id.get(dev_type, dev_type)
+
+			j = i + 4
+			props_list = []
+			props_end = min(j + props_size, len(table_bytes))
+
+			while j + 3 < props_end:
+				prop_id, prop_size = ZbntClient._device_property_struct.unpack_from(table_bytes, j)
+				prop_id = properties_by_id.get(prop_id, prop_id)
+				prop_value = table_bytes[j+4:min(j+4+prop_size, props_end)]
+
+				props_list.append( (prop_id, prop_value) )
+				j += 4 + prop_size
+
+			device_table.append( (dev_id, dev_type, props_list) )
+			i += 4 + props_size
+
+		return device_table
+
+	def run_start_received(self, msg_id, msg_payload):
+		self.resolve_request( (msg_id, None, None), True )
+
+	def run_stop_received(self, msg_id, msg_payload):
+		self.running = False
+
+		if self.measurement_queue != None:
+			# Wait until every queued measurement has been handled
+			asyncio.get_running_loop().create_task(self.finish_run())
+		else:
+			self.flush_batch()
+			self.flush_columnar()
 			self.on_run_end.set_result(None)
-		elif msg_id == Messages.MSG_ID_SET_PROPERTY or msg_id == Messages.MSG_ID_GET_PROPERTY:
-			if len(msg_payload) < 4:
-				return
 
-			dev_id = msg_payload[0]
-			prop_id = decode_u16(msg_payload[1:3])
-			success = bool(msg_payload[3])
-			value = msg_payload[4:]
+	def property_received(self, msg_id, msg_payload):
+		if len(msg_payload) < 4:
+			return
+
+		dev_id = msg_payload[0]
+		prop_id = decode_u16(msg_payload, 1)
+		success = bool(msg_payload[3])
+		value = msg_payload[4:]
 
-			if self.pending_msg == msg_id and self.pending_msg_params == (dev_id, prop_id):
-				if msg_id == Messages.MSG_ID_GET_PROPERTY:
-					self.pending_msg_future.set_result( (success, value) )
-				else:
-					self.pending_msg_future.set_result(success)
+		if msg_id == Messages.MSG_ID_GET_PROPERTY:
+			self.resolve_request( (msg_id, dev_id, prop_id), (success, value) )
+		else:
+			self.resolve_request( (msg_id, dev_id, prop_id), success )
+
+class BufferedZbntClient(ZbntClient, asyncio.BufferedProtocol):
+	# Receives data directly into a preallocated buffer, measurement payloads are passed as memoryview objects
+	pass
+
+class ThreadedZbntClient(ZbntClient):
+	# The socket is owned by a reader thread that parses every message, measurements are passed directly to
+	# subscribers marked as threadsafe, everything else is forwarded in order to the event loop
+	# Queues are filled in the event loop after a whole chunk has been parsed, so once paused they can exceed
+	# their size by the measurements contained in one chunk of at most ThreadedTransport.RECV_SIZE bytes
+	_pause_parsing = False
+	def __init__(self):
+		super().__init__()
 
-				self.pending_msg = None
-				self.pending_msg_params = None
-				self.pending_msg_future = None
-		elif msg_id & Messages.MSG_ID_MEASUREMENT:
-			dev_id = msg_id & ~Messages.MSG_ID_MEASUREMENT
-			dev_obj = self.devices.get(dev_id, None)
+		self.loop = asyncio.get_running_loop()
+		self.posted = []
 
-			if dev_id != None and len(msg_payload) >= 8 and self.callback != None:
-				meas_obj = dev_obj.receive_measurement(msg_payload)
+	async def open_connection(self):
+		if isinstance(self.endpoint, tuple):
+			sock = await self.loop.run_in_executor(None, socket.create_connection, self.endpoint)
+			sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		else:
+			sock = ZbntClient.open_local_socket(self.endpoint)
 
-				if meas_obj != None:
-					self.callback(dev_obj, meas_obj)
+		ThreadedTransport(self.loop, sock, self).start()
+
+	def wrap_subscriber(self, subscriber, threadsafe):
+		if threadsafe:
+			return subscriber
+
+		return lambda dev_obj, value: self.posted.append( (subscriber, dev_obj, value) )
+
+	def thread_data_received(self, data):
+		self.bytes_received(data)
+
+		if len(self.posted):
+			posted = self.posted
+			self.posted = []
+
+			self.loop.call_soon_threadsafe(self.run_posted, posted)
+
+	def run_posted(self, posted):
+		for function, arg0, arg1 in posted:
+			function(arg0, arg1)
+
+		self.chunk_processed()
+
+	def control_received(self, msg_id, msg_payload):
+		self.posted.append( (super().control_received, msg_id, bytes(msg_payload)) )
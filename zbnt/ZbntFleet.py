@@ -0,0 +1,101 @@
+"""
+	zbnt/python-client
+	Copyright (C) 2022 Oscar R.
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+
+from .ZbntClient import *
+
+class ZbntFleet:
+	# Controls several ZBNT servers at once, boards are identified by the device dictionaries returned by
+	# discover_devices. Every operation is sent to all boards in the same event loop iteration.
+
+	def __init__(self, boards, failed=None):
+		self.boards = boards
+		self.failed = [] if failed == None else failed
+		self.subscriptions = []
+
+	def __repr__(self):
+		return f"ZbntFleet(boards={len(self.boards)}, failed={len(self.failed)})"
+
+	def __len__(self):
+		return len(self.boards)
+
+	@staticmethod
+	async def connect(devices, timeout=5, **kwargs):
+		# Boards that couldn't be connected to are stored in fleet.failed as (device, error) tuples
+		results = await asyncio.gather(
+			*[ZbntClient.connect(d, timeout, **kwargs) for d in devices],
+			return_exceptions=True
+		)
+
+		boards = []
+		failed = []
+
+		for device, client in zip(devices, results):
+			if isinstance(client, ZbntClient):
+				boards.append( (device, client) )
+			else:
+				failed.append( (device, client) )
+
+		return ZbntFleet(boards, failed)
+
+	@property
+	def clients(self):
+		return [client for _, client in self.boards]
+
+	def get_client(self, name):
+		for device, client in self.boards:
+			if device["name"] == name:
+				return client
+
+		return None
+
+	async def load_bitstream(self, name, reload=True):
+		return await asyncio.gather(*[c.load_bitstream(name, reload) for c in self.clients])
+
+	async def configure(self, config_fn):
+		# config_fn(device, client) must return the configuration dictionary for that board
+		return await asyncio.gather(*[c.configure(config_fn(d, c)) for d, c in self.boards])
+
+	async def start_run(self):
+		await asyncio.gather(*[c.start_run() for c in self.clients])
+
+	async def stop_run(self):
+		await asyncio.gather(*[c.stop_run() for c in self.clients])
+
+	async def wait_for_run_end(self):
+		await asyncio.gather(*[c.wait_for_run_end() for c in self.clients])
+
+	def subscribe(self, callback, device_type=None, gaps=False):
+		# callback(board, device, measurement) will be called for every measurement received from any board
+		for board, client in self.boards:
+			subscriber = lambda dev_obj, meas_obj, board=board: callback(board, dev_obj, meas_obj)
+
+			self.subscriptions.append( (callback, client, subscriber) )
+			client.subscribe(subscriber, device_type=device_type, gaps=gaps)
+
+	def unsubscribe(self, callback):
+		for s_callback, client, subscriber in self.subscriptions:
+			if s_callback == callback:
+				client.unsubscribe(subscriber)
+
+		self.subscriptions = [s for s in self.subscriptions if s[0] != callback]
+
+	def disconnect(self):
+		for client in self.clients:
+			client.disconnect()
@@ -18,5 +18,9 @@
 
 from .Enums import *
 from .ZbntClient import *
+from .MeasurementFanout import *
+from .ZbntFleet import *
 from .DiscoveryClient import *
+from .DiscoveryService import *
+from .DiscoveryMonitor import *
 from .PcapWriter import *